@@ -1,10 +1,16 @@
 from signal import signal, SIGINT, SIGPIPE, SIG_DFL
 from os import kill, getpid
+import os
+from errno import EXDEV, ENOSYS, EINVAL, EBADF, EOPNOTSUPP
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 from inspect import signature, Parameter
 from clifunc import splitdoc
 import email.parser
 from warnings import warn
+import cProfile
+from io import SEEK_CUR, UnsupportedOperation, BytesIO
+import zlib
+import re
 
 def run_cli(main):
     try:
@@ -71,13 +77,19 @@ def run_cli(main):
             name = name.replace("_", "-")
             group.add_argument(*short, name, **kw, **attrs)
         assert paired == groups.keys()
+        parser.add_argument("--profile", metavar="FILENAME",
+            help="record \"cProfile\" statistics of the run in this file")
         
         args = dict(vars(parser.parse_args()))
+        profile = args.pop("profile")
         if pos is None:
             pos = ()
         else:
             pos = args.pop(pos)
-        main(*pos, **args)
+        if profile is None:
+            main(*pos, **args)
+        else:
+            run_profiled(main, pos, args, profile)
     except KeyboardInterrupt:
         signal(SIGINT, SIG_DFL)
         kill(getpid(), SIGINT)
@@ -85,6 +97,41 @@ def run_cli(main):
         signal(SIGPIPE, SIG_DFL)
         kill(getpid(), SIGPIPE)
 
+profiler = None
+
+def run_profiled(main, pos, kw, filename):
+    """Runs main() with the global profiler enabled
+    
+    The statistics are written even if main() raises an exception, so
+    that an interrupted conversion can still be analysed. Entry points
+    may disable the global profiler and enable it around sections of
+    interest."""
+    
+    global profiler
+    profiler = Profiler()
+    profiler.enable()
+    try:
+        return main(*pos, **kw)
+    finally:
+        profiler.profile.disable()
+        profiler.profile.dump_stats(filename)
+        profiler = None
+
+class Profiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.depth = 0
+    
+    def enable(self):
+        if not self.depth:
+            self.profile.enable()
+        self.depth += 1
+    
+    def disable(self):
+        self.depth -= 1
+        if not self.depth:
+            self.profile.disable()
+
 def parse_path(path):
     if path == "/":
         return ()
@@ -93,6 +140,16 @@ def parse_path(path):
     return tuple(path[1:].split("/"))
 
 def read_record(stream):
+    message = read_header(stream)
+    return (message, read_content(stream, message))
+
+def read_header(stream):
+    [message, _] = read_raw_header(stream)
+    return message
+
+def read_raw_header(stream):
+    """Returns the parsed header and its original bytes"""
+    
     # Skip blank lines. Record bodies are supposed to be followed by a blank
     # separator line. In addition, Node-path records tend to have one or two
     # extra blank lines after them.
@@ -104,21 +161,458 @@ def read_record(stream):
         raise EOFError()
     
     parser = email.parser.BytesFeedParser()
+    lines = list()
     while True:
         assert line.endswith(b"\n")
         parser.feed(line)
+        lines.append(line)
         if not line.rstrip(b"\r\n"):
             break
         line = stream.readline()
     message = parser.close()
     for defect in message.defects:
         warn(f"{stream.name}: {defect!r}")
-    
+    return (message, b"".join(lines))
+
+def read_content(stream, message):
     length = message.get_all("Content-length")
     if not length:
-        return (message, None)
+        return None
     [length] = length
     length = int(length)
     content = stream.read(length)
     assert len(content) == length
-    return (message, content)
+    return content
+
+def parse_content(header, content):
+    props = dict()
+    props_length = header.get_all("Prop-content-length")
+    if props_length:
+        [props_length] = props_length
+        props = parse_props(content[:int(props_length)])
+        content = content[int(props_length):]
+    length = header.get_all("Text-content-length")
+    if length is None:
+        assert not content
+        content = None
+    else:
+        [length] = length
+        assert len(content) == int(length)
+    return (props, content)
+
+def parse_props(data):
+    props = dict()
+    props_data = BytesIO(data)
+    for line in iter(props_data.readline, b"PROPS-END\n"):
+        assert line.endswith(b"\n")
+        assert line.startswith(b"K ")
+        length = int(line[2:-1])
+        name = props_data.read(length)
+        assert len(name) == length
+        line = props_data.read(1)
+        assert line == b"\n"
+        line = props_data.readline()
+        assert line.endswith(b"\n")
+        assert line.startswith(b"V ")
+        length = int(line[2:-1])
+        value = props_data.read(length)
+        assert len(value) == length
+        props[name] = value.decode("utf-8")
+        line = props_data.read(1)
+        assert line == b"\n"
+    return props
+
+def skip_content(stream, message):
+    """Skips a record's content, seeking past it if possible
+    
+    Returns the number of bytes skipped."""
+    
+    length = message.get_all("Content-length")
+    if not length:
+        return 0
+    [length] = length
+    length = int(length)
+    if stream.seekable():
+        stream.seek(length, SEEK_CUR)
+    else:
+        remaining = length
+        while remaining:
+            chunk = stream.read(min(remaining, 0x10000))
+            assert chunk
+            remaining -= len(chunk)
+    return length
+
+def copy_stream(source, dest, length, bufsize=0x100000):
+    """Copies bytes from the current position of one file to another
+    
+    If the source is a seekable file with a descriptor, the copy is
+    done by the kernel with os.copy_file_range() or os.sendfile().
+    Otherwise at most "bufsize" bytes are held in memory at a time."""
+    
+    if source.seekable():
+        try:
+            fds = (source.fileno(), dest.fileno())
+        except (AttributeError, UnsupportedOperation):
+            fds = None
+        if fds is not None:
+            pos = source.tell()
+            dest.flush()
+            if dest.seekable():
+                dest_pos = dest.tell()
+            if _copy_fds(*fds, pos, length):
+                source.seek(pos + length)
+                if dest.seekable():
+                    # Resynchronize the buffered position
+                    dest.seek(dest_pos + length)
+                return
+    while length:
+        chunk = source.read(min(length, bufsize))
+        if not chunk:
+            raise EOFError()
+        dest.write(chunk)
+        length -= len(chunk)
+
+# Errors meaning the kernel cannot copy between these files
+_COPY_UNSUPPORTED = {EXDEV, ENOSYS, EINVAL, EBADF, EOPNOTSUPP}
+
+def _copy_fds(source, dest, offset, length):
+    """Returns False if nothing could be copied"""
+    for copy in (_copy_file_range, _sendfile):
+        try:
+            n = copy(source, dest, offset, length)
+        except OSError as err:
+            if err.errno not in _COPY_UNSUPPORTED:
+                raise
+            continue
+        if n is None:
+            continue
+        while n:
+            offset += n
+            length -= n
+            if not length:
+                break
+            n = copy(source, dest, offset, length)
+        if length:
+            raise EOFError()
+        return True
+    return False
+
+def _copy_file_range(source, dest, offset, length):
+    try:
+        copy_file_range = os.copy_file_range
+    except AttributeError:
+        return None
+    return copy_file_range(source, dest, length, offset)
+
+def _sendfile(source, dest, offset, length):
+    try:
+        sendfile = os.sendfile
+    except AttributeError:
+        return None
+    return sendfile(dest, source, offset, length)
+
+# "svndiff" instructions
+SVNDIFF_SOURCE = 0
+SVNDIFF_TARGET = 1
+SVNDIFF_NEW = 2
+
+# Target window size used by Subversion
+SVNDIFF_WINDOW = 102400
+
+def apply_svndiff(source, delta):
+    """Applies an "svndiff0" or "svndiff1" delta to the source text
+    
+    The source may be None if the delta does not refer to it."""
+    
+    delta = BytesIO(delta)
+    header = delta.read(4)
+    assert header in {b"SVN\x00", b"SVN\x01"}
+    version = header[3]
+    target = bytearray()
+    while delta.read(1):
+        delta.seek(-1, SEEK_CUR)
+        source_offset = read_int(delta)
+        source_length = read_int(delta)
+        target_length = read_int(delta)
+        instr_length = read_int(delta)
+        new_length = read_int(delta)
+        instr_data = delta.read(instr_length)
+        assert len(instr_data) == instr_length
+        new = delta.read(new_length)
+        assert len(new) == new_length
+        if version == 1:
+            instr_data = _svndiff_decompress(instr_data)
+            new = _svndiff_decompress(new)
+        if source_length:
+            view = source[source_offset:source_offset + source_length]
+            assert len(view) == source_length
+        
+        instr_data = BytesIO(instr_data)
+        new = BytesIO(new)
+        window = bytearray()
+        while True:
+            instr = instr_data.read(1)
+            if not instr:
+                break
+            [instr] = instr
+            copy = instr & 0x3F
+            instr >>= 6
+            if not copy:
+                copy = read_int(instr_data)
+            if instr == SVNDIFF_SOURCE:
+                offset = read_int(instr_data)
+                data = view[offset:offset + copy]
+            elif instr == SVNDIFF_TARGET:
+                offset = read_int(instr_data)
+                data = window[offset:offset + copy]
+                # Repeat if length greater than existing target size
+                data *= -(-copy // len(data))
+                data = data[:copy]
+            else:
+                assert instr == SVNDIFF_NEW
+                data = new.read(copy)
+            assert len(data) == copy
+            window.extend(data)
+        assert len(window) == target_length
+        target.extend(window)
+    return target
+
+def _svndiff_decompress(data):
+    data = BytesIO(data)
+    length = read_int(data)
+    data = data.read()
+    if len(data) < length:
+        data = zlib.decompress(data)
+    assert len(data) == length
+    return data
+
+# Size of the source blocks indexed when encoding deltas
+SVNDIFF_BLOCK = 64
+
+def encode_svndiff(source, target):
+    """Encodes an "svndiff0" delta
+    
+    The source is indexed by hashing aligned blocks. Each position of the
+    target is looked up in the index, and matches are extended in both
+    directions, so text moved by insertions and deletions is still
+    copied. Source views never slide backwards between windows, as
+    Subversion requires."""
+    
+    if source is None:
+        source = b""
+    index = {source[i:i + SVNDIFF_BLOCK]: i
+        for i in range(0, len(source) - SVNDIFF_BLOCK + 1, SVNDIFF_BLOCK)}
+    delta = BytesIO()
+    delta.write(b"SVN\x00")
+    view = (0, 0)
+    for start in range(0, len(target), SVNDIFF_WINDOW):
+        end = min(start + SVNDIFF_WINDOW, len(target))
+        matches = _find_matches(index, source, target, start, end, view[0])
+        view = _encode_window(delta, source, target, start, end, matches,
+            view)
+    return delta.getvalue()
+
+def _find_matches(index, source, target, start, end, floor):
+    """Returns (target offset, source offset, length) of copies within
+    a target window, from source offsets no lower than the floor"""
+    
+    matches = list()
+    new = start  # Start of target data not yet matched
+    pos = start
+    last = end - SVNDIFF_BLOCK
+    while pos <= last:
+        offset = index.get(target[pos:pos + SVNDIFF_BLOCK])
+        if offset is None or offset < floor:
+            pos += 1
+            continue
+        length = SVNDIFF_BLOCK + _common_prefix(source,
+            offset + SVNDIFF_BLOCK, target, pos + SVNDIFF_BLOCK, end)
+        # Extend back over data that would otherwise be new
+        while pos > new and offset > floor \
+                and source[offset - 1] == target[pos - 1]:
+            pos -= 1
+            offset -= 1
+            length += 1
+        matches.append((pos, offset, length))
+        pos += length
+        new = pos
+    return matches
+
+def _common_prefix(source, offset, target, pos, end):
+    """Returns the length of common data, comparing chunks at a time"""
+    limit = min(len(source) - offset, end - pos)
+    length = 0
+    while length < limit:
+        size = min(SVNDIFF_BLOCK, limit - length)
+        if source[offset + length:offset + length + size] \
+                != target[pos + length:pos + length + size]:
+            break
+        length += size
+    while length < limit and source[offset + length] == target[pos + length]:
+        length += 1
+    return length
+
+def _encode_window(delta, source, target, start, end, matches, view):
+    """Writes a window and returns its source view"""
+    
+    [view_offset, view_length] = view
+    view_end = view_offset + view_length
+    if matches:
+        view_offset = min(offset for [_, offset, _] in matches)
+        view_end = max([view_end] +
+            [offset + length for [_, offset, length] in matches])
+    
+    instructions = BytesIO()
+    new = BytesIO()
+    pos = start
+    for [target_offset, offset, length] in matches:
+        if target_offset > pos:
+            _write_instruction(instructions, SVNDIFF_NEW,
+                target_offset - pos)
+            new.write(target[pos:target_offset])
+        _write_instruction(instructions, SVNDIFF_SOURCE, length,
+            offset - view_offset)
+        pos = target_offset + length
+    if end > pos:
+        _write_instruction(instructions, SVNDIFF_NEW, end - pos)
+        new.write(target[pos:end])
+    instructions = instructions.getvalue()
+    new = new.getvalue()
+    
+    for n in (view_offset, view_end - view_offset, end - start,
+            len(instructions), len(new)):
+        write_int(delta, n)
+    delta.write(instructions)
+    delta.write(new)
+    return (view_offset, view_end - view_offset)
+
+def _write_instruction(file, action, length, offset=None):
+    if length < 0x40:
+        file.write(bytes((action << 6 | length,)))
+    else:
+        file.write(bytes((action << 6,)))
+        write_int(file, length)
+    if offset is not None:
+        write_int(file, offset)
+
+def read_int(stream):
+    i = 0
+    while True:
+        [byte] = stream.read(1)
+        i = i << 7 | byte & 0x7F
+        if not byte & 0x80:
+            return i
+
+def write_int(file, n):
+    digits = [n & 0x7F]
+    n >>= 7
+    while n:
+        digits.append(n & 0x7F | 0x80)
+        n >>= 7
+    file.write(bytes(reversed(digits)))
+
+class PathFilter:
+    """Compiled include and exclude patterns for relative paths
+    
+    A pattern selects the named path and everything under it. Plain
+    paths are stored in a trie of path components, so matching costs
+    the depth of the path rather than the number of patterns. Patterns
+    with glob characters are combined into a single regular expression.
+    Excludes take precedence, and if there are no includes, everything
+    not excluded is selected."""
+    
+    def __init__(self, include=(), exclude=()):
+        self.include = _Patterns(include) if include else None
+        self.exclude = _Patterns(exclude)
+    
+    def selected(self, path):
+        if self.exclude.match(path):
+            return False
+        return self.include is None or self.include.match(path)
+    
+    def touches(self, path):
+        """Whether the path or anything under it is selected"""
+        if self.exclude.match(path):
+            return False
+        return self.include is None or self.include.match(path) \
+            or self.include.is_ancestor(path)
+
+class _Patterns:
+    def __init__(self, patterns):
+        self.trie = dict()
+        globs = list()
+        for pattern in patterns:
+            pattern = pattern.strip("/")
+            if any(c in pattern for c in "*?["):
+                globs.append(_translate_glob(pattern))
+                continue
+            node = self.trie
+            if pattern:
+                for name in pattern.split("/"):
+                    node = node.setdefault(name, dict())
+            node[None] = True
+        if globs:
+            self.glob = re.compile(r"(?:{})(?:/.*)?".format("|".join(globs)),
+                re.DOTALL)
+        else:
+            self.glob = None
+    
+    def match(self, path):
+        node = self.trie
+        if None in node:
+            return True
+        if path:
+            for name in path.split("/"):
+                node = node.get(name)
+                if node is None:
+                    break
+                if None in node:
+                    return True
+        return self.glob is not None and bool(self.glob.fullmatch(path))
+    
+    def is_ancestor(self, path):
+        if self.glob is not None:
+            return True  # Conservative
+        node = self.trie
+        if path:
+            for name in path.split("/"):
+                node = node.get(name)
+                if node is None:
+                    return False
+        return True
+
+def _translate_glob(pattern):
+    """Converts a shell-style pattern to an unanchored regular expression
+    
+    As with "fnmatch", wildcards also match slashes."""
+    
+    regex = list()
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            regex.append(".*")
+        elif c == "?":
+            regex.append(".")
+        elif c == "[":
+            end = i
+            if end < len(pattern) and pattern[end] == "!":
+                end += 1
+            if end < len(pattern) and pattern[end] == "]":
+                end += 1
+            end = pattern.find("]", end)
+            if end < 0:
+                regex.append(re.escape(c))
+                continue
+            chars = pattern[i:end]
+            i = end + 1
+            negate = chars.startswith("!")
+            if negate:
+                chars = chars[1:]
+            # Keep hyphens for ranges, but escape everything else literally
+            chars = "".join(c if c == "-" else re.escape(c) for c in chars)
+            regex.append("[{}{}]".format("^" if negate else "", chars))
+        else:
+            regex.append(re.escape(c))
+    return "".join(regex)
@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+
+"""Times the main code paths against a synthetic repository"""
+
+from tempfile import TemporaryDirectory
+from io import BytesIO, TextIOWrapper
+from time import perf_counter
+from contextlib import contextmanager
+import platform
+import os.path
+import json
+import sys
+import synthrepo
+import svnlog
+from _common import read_record
+
+FORMAT = 1
+
+def main(*,
+    output: dict(metavar="FILENAME",
+        help="JSON results file (default: stdout)") = None,
+    only: dict(metavar="NAME", help="only run this benchmark") = (),
+    repeat: dict(help="number of timed runs of each benchmark") = 3,
+    revisions: dict(help="number of revisions") = 100,
+    files: dict(help="files modified in each revision") = 10,
+    size: dict(help="approximate file size in bytes") = 1000,
+    deltas: dict(help="write modifications as svndiff deltas") = False,
+    branches: dict(help="number of branches copied from trunk") = 0,
+    copies: dict(help="number of file copies within trunk") = 0,
+    seed: dict(help="random number generator seed") = 0,
+):
+    """Times the main code paths against a synthetic repository
+    
+    Benchmarks: read_record, svndiff, iter_svnlog, export, svndump.
+    The JSON results record the repository parameters, so that results
+    from different releases can be compared."""
+    
+    params = dict(revisions=revisions, files=files, size=size,
+        deltas=deltas, branches=branches, copies=copies, seed=seed)
+    results = run(params, only=only, repeat=repeat)
+    if output is None:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        with open(output, "wt") as file:
+            json.dump(results, file, indent=1)
+            print(file=file)
+
+def run(params, *, only=(), repeat=3):
+    revs = synthrepo.generate(**params)
+    with TemporaryDirectory(prefix="svnex-bench-") as dir:
+        repo = Repo(dir, revs)
+        results = dict()
+        for [name, benchmark] in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            runs = list()
+            try:
+                for _ in range(repeat):
+                    start = perf_counter()
+                    benchmark(repo)
+                    runs.append(perf_counter() - start)
+            except Exception as err:
+                results[name] = {"error": repr(err)}
+                continue
+            best = min(runs)
+            size = getattr(repo, SIZES[name])
+            results[name] = {
+                "best": best,
+                "mean": sum(runs) / len(runs),
+                "runs": runs,
+                "input bytes": size,
+                "MB/s": size / best / 1e6 if best else None,
+            }
+    return {
+        "format": FORMAT,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "params": params,
+        "dump bytes": repo.dump_size,
+        "log bytes": repo.log_size,
+        "results": results,
+    }
+
+class Repo:
+    def __init__(self, dir, revs):
+        self.dir = dir
+        self.dump = os.path.join(dir, "dump")
+        with open(self.dump, "wb") as file:
+            synthrepo.write_dump(file, revs)
+        self.dump_size = os.path.getsize(self.dump)
+        log = BytesIO()
+        synthrepo.write_log(log, revs)
+        self.log = log.getvalue()
+        self.log_size = len(self.log)
+        self.deltas = [(node["delta_base"], node["content"])
+            for rev in revs for node in rev["nodes"] if node.get("delta")]
+        self.deltas_size = sum(len(delta) for [_, delta] in self.deltas)
+
+def bench_read_record(repo):
+    with open(repo.dump, "rb") as dump:
+        while True:
+            try:
+                read_record(dump)
+            except EOFError:
+                break
+
+def bench_svndiff(repo):
+    from _common import apply_svndiff
+    for [source, delta] in repo.deltas:
+        apply_svndiff(source, delta)
+
+def bench_iter_svnlog(repo):
+    for _ in svnlog.iter_svnlog(BytesIO(repo.log)):
+        pass
+
+def bench_export(repo):
+    import svnex
+    output = os.path.join(repo.dir, "output")
+    log = TextIOWrapper(BytesIO(repo.log), "utf-8")
+    with replaced(svnex, "stdin", log), svnex.FastExportFile(output) as fex, \
+            open(repo.dump, "rb") as dump:
+        exporter = svnex.Exporter(dump, fex, root="", quiet=True)
+        exporter.export("refs/heads/trunk", "trunk")
+
+def bench_svndump(repo):
+    import svndump
+    with open(os.devnull, "wb") as null:
+        stdout = TextIOWrapper(null)
+        with replaced(svndump, "stdout", stdout):
+            svndump.main(repo.dump, repo.dump)
+        stdout.detach()
+
+BENCHMARKS = {
+    "read_record": bench_read_record,
+    "svndiff": bench_svndiff,
+    "iter_svnlog": bench_iter_svnlog,
+    "export": bench_export,
+    "svndump": bench_svndump,
+}
+
+# Input that each benchmark processes, for throughput figures
+SIZES = {
+    "read_record": "dump_size",
+    "svndiff": "deltas_size",
+    "iter_svnlog": "log_size",
+    "export": "dump_size",
+    "svndump": "dump_size",
+}
+
+@contextmanager
+def replaced(module, name, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield value
+    finally:
+        setattr(module, name, original)
+
+if __name__ == "__main__":
+    from _common import run_cli
+    run_cli(main)
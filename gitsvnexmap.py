@@ -2,74 +2,234 @@
 
 import subprocess
 import sys
+import os
 from uuid import UUID
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+import revmap
 
-def main(*roots, uuid=()):
+def main(*roots, uuid=(), binary=None, scan=False, jobs=None, cache=None):
     """Generates a file for "svnex --rev-map" from a Git repository
     
     roots: Collection of repository root URLs
     uuid: Collection of repository UUIDs to match
+    binary: Write a binary revision map to this file, rather than writing
+        the text format to stdout
+    scan: Find the commits reachable from all Git references, rather
+        than reading revisions from stdin
+    jobs: When scanning, read the matching commits with this number of
+        parallel "git cat-file" processes, rather than a single "git log"
+    cache: When scanning, keep the reference tips and revision map in
+        this file, so that the next scan only reads newer commits
     
-    Standard input should be a list of Git revisions, such as from "git
-    rev-list --all"."""
+    Without "scan", standard input should be a list of Git revisions,
+    such as from "git rev-list --all". Commits that are no longer
+    reachable stay in the cache; delete the file to scan every commit
+    again."""
     
     if not roots:
         raise SystemExit("Need at least one root URL to match against")
     uuids = set(map(UUID, uuid))
+    entries = list()
     
-    input = sys.stdin.detach()
-    catfile = ("git", "cat-file", "--batch")
-    with subprocess.Popen(catfile,
-    stdin=input, stdout=subprocess.PIPE, bufsize=-1) as catfile:
-        input.close()
-        
-        fail = False
-        for header in catfile.stdout:
-            (rev, type, length) = header.split(maxsplit=3)[:3]
-            if type != b"commit":
-                msg = "Unexpected Git object type {!r}"
-                raise SystemExit(msg.format(type.decode("ascii")))
-            rev = rev.decode("ascii")
-            length = int(length)
+    # Revision map lines, in order, without duplicates
+    found = dict()
+    exclude = ()
+    if cache is not None:
+        if not scan:
+            raise SystemExit("A cache is only used when scanning")
+        try:
+            (exclude, lines) = read_cache(cache)
+        except FileNotFoundError:
+            pass
+        else:
+            found.update(dict.fromkeys(lines))
+            if binary is None:
+                for line in lines:
+                    print(line)
+            else:
+                entries.extend(revmap.iter_text(lines))
+    
+    if not scan:
+        messages = iter_catfile(sys.stdin.detach())
+    else:
+        (tips, revs) = scan_revs(exclude)
+        if not tips:
+            messages = ()  # Git would otherwise default to HEAD
+        elif jobs is None:
+            messages = iter_log(revs)
+        else:
+            messages = iter_catfile_pool(int(jobs), revs)
+    
+    fail = False
+    for (rev, message) in messages:
+        rev = rev.decode("ascii")
+        for line in message.splitlines():
+            prefix = b"git-svn-id:"
+            if not line.lower().startswith(prefix):
+                continue
+            line = line[len(prefix):].strip()
             
-            while True:
-                line = next(catfile.stdout)
-                length -= len(line)
-                if not line.strip():
+            (url, uuid) = line.split(maxsplit=2)[:2]
+            uuid = uuid.decode("ascii")
+            if uuids and UUID(uuid) not in uuids:
+                continue
+            
+            url = url.decode("ascii")
+            for root in roots:
+                if url.startswith(root):
                     break
+            else:
+                msg = "Cannot determine root: {}".format(url)
+                print(msg, file=sys.stderr)
+                fail = True
+                continue
+            path = url[len(root):]
             
-            for line in catfile.stdout.read(length).splitlines():
-                prefix = b"git-svn-id:"
-                if not line.lower().startswith(prefix):
-                    continue
-                line = line[len(prefix):].strip()
-                
-                (url, uuid) = line.split(maxsplit=2)[:2]
-                uuid = uuid.decode("ascii")
-                if uuids and UUID(uuid) not in uuids:
-                    continue
-                
-                url = url.decode("ascii")
-                for root in roots:
-                    if url.startswith(root):
-                        break
-                else:
-                    msg = "Cannot determine root: {}".format(url)
-                    print(msg, file=sys.stderr)
-                    fail = True
-                    continue
-                path = url[len(root):]
-                
-                if not path.rindex("@"):
-                    path = "/" + path
-                
-                print("{} {}".format(path, rev))
+            if not path.rindex("@"):
+                path = "/" + path
             
-            if catfile.stdout.readline().strip():
-                raise SystemExit("No blank line following Git object")
+            line = "{} {}".format(path, rev)
+            if line in found:
+                continue
+            found[line] = None
+            if binary is None:
+                print("{} {}".format(path, rev))
+            else:
+                (path, svnrev) = path.rsplit("@", 1)
+                entries.append((path, int(svnrev), rev))
+    
+    if fail:
+        raise SystemExit(fail)
+    
+    if binary is not None:
+        with open(binary, "wb") as file:
+            revmap.write_binary(file, entries)
+    if cache is not None:
+        write_cache(cache, tips, found)
+
+def read_cache(filename):
+    """Returns the reference tips and revision map lines from a cache
+    
+    Each line of the file is either a tip, or a revision map entry
+    in the text format."""
+    
+    tips = list()
+    lines = list()
+    with open(filename, "rt") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if " " in line:
+                lines.append(line)
+            else:
+                tips.append(line.encode("ascii"))
+    return (tips, lines)
+
+def write_cache(filename, tips, lines):
+    with open(filename + ".new", "wt") as file:
+        for tip in tips:
+            print(tip.decode("ascii"), file=file)
+        for line in lines:
+            print(line, file=file)
+    os.replace(filename + ".new", filename)
+
+def scan_revs(exclude=()):
+    """Returns the tips of all references, and the revisions for a
+    commit walk that excludes commits reachable from "exclude"
+    
+    Excluded tips that no longer exist are ignored."""
+    
+    tips = subprocess.check_output(("git", "rev-parse", "--all"))
+    tips = tips.splitlines()
+    if exclude:
+        check = ("git", "cat-file", "--batch-check=%(objectname)")
+        exclude = subprocess.run(check, input=b"\n".join(exclude) + b"\n",
+            stdout=subprocess.PIPE, check=True).stdout
+        exclude = [b"^" + tip for tip in exclude.splitlines()
+            if not tip.endswith(b" missing")]
+    return (tips, tips + list(exclude))
+
+# Only commits with a matching line need to be read
+GREP = ("--regexp-ignore-case", "--grep=^git-svn-id:")
+
+def iter_log(revs, bufsize=0x10000):
+    """Yields (rev, message) for matching commits from one "git log"
+    
+    Each hash and message is terminated by a null byte, so the output
+    is split in bulk rather than parsed line by line."""
+    
+    log = ("git", "log", "--stdin", "-z", "--format=%H%x00%B") + GREP
+    with subprocess.Popen(log,
+    stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
+        # Git reads all the revisions before writing any output
+        process.stdin.write(b"".join(rev + b"\n" for rev in revs))
+        process.stdin.close()
+        fields = list()
+        pending = b""
+        while True:
+            data = process.stdout.read(bufsize)
+            if not data:
+                break
+            fields.extend((pending + data).split(b"\x00"))
+            pending = fields.pop()
+            for i in range(0, len(fields) - 1, 2):
+                yield (fields[i], fields[i + 1])
+            del fields[:len(fields) & ~1]
+        # The last message is not terminated
+        if pending:
+            fields.append(pending)
+        if len(fields) == 2:
+            yield tuple(fields)
+        elif fields:
+            raise SystemExit("Truncated output from Git log")
+    if process.returncode:
+        raise SystemExit(process.returncode)
+
+def iter_catfile(input):
+    """Yields (rev, message) for the commits listed in a binary stream"""
+    catfile = ("git", "cat-file", "--batch")
+    with subprocess.Popen(catfile,
+    stdin=input, stdout=subprocess.PIPE, bufsize=-1) as catfile:
+        input.close()
+        yield from parse_batch(catfile.stdout)
+
+def iter_catfile_pool(jobs, revs):
+    """Yields (rev, message) by partitioning the matching commits
+    between parallel "git cat-file" processes
+    
+    The output is in the same order as from a single process."""
+    
+    revs = b"".join(rev + b"\n" for rev in revs)
+    command = ("git", "rev-list", "--stdin") + GREP
+    revs = subprocess.run(command, input=revs, stdout=subprocess.PIPE,
+        check=True).stdout.splitlines(keepends=True)
+    size = max(-(-len(revs) // max(jobs, 1)), 1)
+    parts = (revs[i:i + size] for i in range(0, len(revs), size))
+    with ThreadPoolExecutor(jobs) as executor:
+        for data in executor.map(read_batch, parts):
+            yield from parse_batch(BytesIO(data))
+
+def read_batch(revs):
+    catfile = ("git", "cat-file", "--batch")
+    return subprocess.run(catfile, input=b"".join(revs),
+        stdout=subprocess.PIPE, check=True).stdout
+
+def parse_batch(stream):
+    """Parses commits from "git cat-file --batch" output"""
+    for header in stream:
+        header = header.split(maxsplit=3)
+        if len(header) < 3:
+            msg = "Missing Git object {!r}"
+            raise SystemExit(msg.format(header[0].decode("ascii")))
+        (rev, type, length) = header[:3]
+        if type != b"commit":
+            msg = "Unexpected Git object type {!r}"
+            raise SystemExit(msg.format(type.decode("ascii")))
         
-        if fail:
-            raise SystemExit(fail)
+        commit = stream.read(int(length))
+        if stream.readline().strip():
+            raise SystemExit("No blank line following Git object")
+        yield (rev, commit.partition(b"\n\n")[2])
 
 if __name__ == "__main__":
     from funcparams import command
@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+
+"""Maps from Subversion branch revisions to Git revisions
+
+The text format, as read by "svnex --rev-map", has one line per Git
+revision, formatted as PATH@SVN-REV (space) GIT-REV. The binary format
+holds the same information sorted, so that it can be searched in place
+without loading it:
+
+* header: magic, format version, hash size, path count, entry count
+* path index, sorted by path: name offset, name length, first entry
+    and entry count
+* entries, sorted by revision within each path: Subversion revision
+    and raw Git hash
+* path names, UTF-8 encoded
+"""
+
+from bisect import bisect_right
+from collections import defaultdict
+from binascii import hexlify, unhexlify
+import mmap
+import struct
+
+MAGIC = b"svnexmap"
+VERSION = 1
+_HEADER = struct.Struct(">8sIIII")
+_PATH = struct.Struct(">QIII")
+_REV = struct.Struct(">I")
+
+def main(input: dict(help="text revision map"),
+        output: dict(help="binary revision map to write")):
+    """Converts a text revision map to the binary format"""
+    with open(input, "rt") as file:
+        entries = list(iter_text(file))
+    with open(output, "wb") as file:
+        write_binary(file, entries)
+
+def load(filename):
+    """Opens a revision map file in either format"""
+    with open(filename, "rb") as file:
+        magic = file.read(len(MAGIC))
+    if magic == MAGIC:
+        return BinaryRevMap(filename)
+    revs = defaultdict(dict)
+    with open(filename, "rt") as file:
+        for [path, svnrev, gitrev] in iter_text(file):
+            revs[path][svnrev] = gitrev
+    return RevMap(revs)
+
+def iter_text(file):
+    for line in file:
+        [s, gitrev] = line.rstrip("\n").rsplit(" ", 1)
+        [path, svnrev] = s.rsplit("@", 1)
+        yield (path, int(svnrev), gitrev)
+
+def write_binary(file, entries):
+    """Writes (path, svnrev, gitrev) entries in the binary format
+    
+    Git revisions have to be full hexadecimal hashes."""
+    
+    paths = defaultdict(dict)
+    hash_size = None
+    for [path, svnrev, gitrev] in entries:
+        gitrev = unhexlify(gitrev)
+        if hash_size is None:
+            hash_size = len(gitrev)
+        elif len(gitrev) != hash_size:
+            raise ValueError(f"Inconsistent Git hash size for {path}@{svnrev}")
+        paths[path.lstrip("/").encode("utf-8")][svnrev] = gitrev
+    if hash_size is None:
+        hash_size = 20
+    
+    paths = sorted(paths.items())
+    entry_count = sum(len(revs) for [_, revs] in paths)
+    names = _HEADER.size + len(paths) * _PATH.size \
+        + entry_count * (_REV.size + hash_size)
+    file.write(_HEADER.pack(MAGIC, VERSION, hash_size, len(paths),
+        entry_count))
+    first = 0
+    for [name, revs] in paths:
+        file.write(_PATH.pack(names, len(name), first, len(revs)))
+        names += len(name)
+        first += len(revs)
+    for [_, revs] in paths:
+        for [svnrev, gitrev] in sorted(revs.items()):
+            file.writelines((_REV.pack(svnrev), gitrev))
+    for [name, _] in paths:
+        file.write(name)
+
+class RevMap:
+    """In-memory revision map, also recording newly exported revisions"""
+    
+    def __init__(self, revs={}):
+        self.branches = defaultdict(lambda: (list(), list()))
+        for (path, path_revs) in revs.items():
+            (svnrevs, gitrevs) = self.branches[path.lstrip("/")]
+            for (svnrev, gitrev) in sorted(path_revs.items()):
+                svnrevs.append(svnrev)
+                gitrevs.append(gitrev)
+    
+    def floor(self, path, rev):
+        """Returns (svnrev, gitrev) for the youngest svnrev <= rev
+        
+        Returns None if no revision of the path is known."""
+        (svnrevs, gitrevs) = self.branches.get(path, ((), ()))
+        i = bisect_right(svnrevs, rev)
+        if not i:
+            return None
+        return (svnrevs[i - 1], gitrevs[i - 1])
+    
+    def add(self, path, svnrev, gitrev):
+        (svnrevs, gitrevs) = self.branches[path]
+        i = bisect_right(svnrevs, svnrev)
+        if i and svnrevs[i - 1] == svnrev:
+            gitrevs[i - 1] = gitrev
+        else:
+            svnrevs.insert(i, svnrev)
+            gitrevs.insert(i, gitrev)
+    
+    def close(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+class BinaryRevMap(RevMap):
+    """Revision map searched in place through a memory-mapped file
+    
+    Newly exported revisions are held in memory on top of the file."""
+    
+    def __init__(self, filename):
+        RevMap.__init__(self)
+        with open(filename, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.hash_size, self.path_count, entry_count) \
+            = _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename}: Unsupported revision map format")
+        self.entries = _HEADER.size + self.path_count * _PATH.size
+        self.entry_size = _REV.size + self.hash_size
+    
+    def close(self):
+        self.map.close()
+    
+    def floor(self, path, rev):
+        found = RevMap.floor(self, path, rev)
+        i = self._find_path(path.encode("utf-8"))
+        if i is None:
+            return found
+        [_, _, first, count] = _PATH.unpack_from(self.map,
+            _HEADER.size + i * _PATH.size)
+        revs = _Revs(self, first, count)
+        j = bisect_right(revs, rev)
+        if not j:
+            return found
+        entry = self.entries + (first + j - 1) * self.entry_size
+        [svnrev] = _REV.unpack_from(self.map, entry)
+        if found is not None and found[0] >= svnrev:
+            return found
+        gitrev = self.map[entry + _REV.size:entry + self.entry_size]
+        return (svnrev, hexlify(gitrev).decode("ascii"))
+    
+    def _find_path(self, name):
+        lo = 0
+        hi = self.path_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            [offset, length, _, _] = _PATH.unpack_from(self.map,
+                _HEADER.size + mid * _PATH.size)
+            found = self.map[offset:offset + length]
+            if found < name:
+                lo = mid + 1
+            elif found > name:
+                hi = mid
+            else:
+                return mid
+        return None
+
+class _Revs:
+    """Sequence view of the Subversion revisions of one path"""
+    
+    def __init__(self, revmap, first, count):
+        self.revmap = revmap
+        self.first = first
+        self.count = count
+    
+    def __len__(self):
+        return self.count
+    
+    def __getitem__(self, i):
+        entry = self.revmap.entries + (self.first + i) * self.revmap.entry_size
+        [svnrev] = _REV.unpack_from(self.revmap.map, entry)
+        return svnrev
+
+if __name__ == "__main__":
+    from _common import run_cli
+    run_cli(main)
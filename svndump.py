@@ -5,12 +5,53 @@ from sys import stdin, stdout
 from contextlib import ExitStack
 import email.message, email.generator
 from warnings import warn
-from _common import read_record
+from _common import read_record, read_header, read_raw_header, read_content
+from _common import PathFilter
+from _common import copy_stream, apply_svndiff, encode_svndiff
+from _common import skip_content, parse_content
+from concurrent.futures import ProcessPoolExecutor
+import os
+import json
+from hashlib import sha1, md5
+import heapq
+from collections import defaultdict, OrderedDict, deque
+from bisect import bisect_right
+from argparse import ArgumentTypeError
+
+def positive_int(value):
+    value = int(value)
+    if value < 1:
+        raise ArgumentTypeError(f"{value} is less than 1")
+    return value
 
 def main(
     *inputs:
         dict(metavar="input", help="input dump streams (default: stdin)"),
     log: dict(short="-l", help="input log stream") = None,
+    split_revs: dict(mutex="mode", type=positive_int, metavar="N",
+        help="split the input into dumps of N revisions each") = None,
+    split_path: dict(mutex="mode", metavar="PREFIX", help="""split nodes
+        under this path into a separate dump, which may be a glob
+        pattern""") = (),
+    deltify: dict(mutex="mode", help="""convert full texts into "svndiff"
+        deltas against the previous text""") = False,
+    undeltify: dict(mutex="mode",
+        help="convert text deltas into full texts") = False,
+    verify: dict(mutex="mode", help="""check the lengths, properties and
+        checksums of each record""") = False,
+    stats: dict(mutex="mode", help="""report the sizes of the dump by path
+        prefix and by revision range, as JSON""") = False,
+    output: dict(short="-o", metavar="FILENAME", help="""output dump file
+        (default: stdout), or, when splitting, a template with "{}"
+        replaced by the number of the split""") = None,
+    cache_mb: dict(metavar="MB", help="""memory for caching previous texts
+        when converting deltas""") = 64,
+    jobs: dict(short="-j", type=int, metavar="N", help="""number of
+        processes verifying records (default: number of CPUs)""") = None,
+    depth: dict(metavar="N",
+        help="number of path components in statistics prefixes") = 2,
+    rev_range: dict(metavar="N",
+        help="number of revisions in each statistics range") = 1000,
 ):
     """Merge dumps of different parts of a Subversion repository
 
@@ -20,8 +61,95 @@ def main(
     Separate dump streams can also be given of separate paths in the
     repository. In this case a log input is also required to determine
     whether there are any copies between the paths to restore.
+    
+    The dumps are merged in one pass, holding one record from each at a
+    time. Revision records with the same number are written once; node
+    records are written in input order, dropping identical duplicates.
+    
+    Alternatively, a single input can be split by revision or by path,
+    so that the parts can be processed in parallel. Splitting by path
+    writes each revision record to every part, and nodes not under any
+    of the paths to a final part, so that the parts can be merged
+    again.
+    
+    Converting to or from deltas locates each previous text in a file,
+    so deltifying needs a seekable input, and undeltifying needs an
+    output file.
+    
+    Verifying reports each corrupt record, by revision and path. The
+    checksums of delta texts are not checked, since that needs the
+    previous texts; they can be checked by undeltifying.
+    
+    Statistics skip over content, so seeking makes them fast. They
+    aggregate content sizes by path prefix and revision range, with the
+    proportion of text stored as deltas.
     """
     
+    if stats:
+        if len(inputs) > 1:
+            raise SystemExit("Statistics take a single input")
+        with ExitStack() as cleanup:
+            if inputs:
+                [input] = inputs
+                stream = cleanup.enter_context(open(input, "rb"))
+            else:
+                stream = stdin.buffer
+            report = dump_stats(stream, depth=depth, rev_range=rev_range)
+            if output is None:
+                file = stdout
+            else:
+                file = cleanup.enter_context(open(output, "wt"))
+            json.dump(report, file, indent=1)
+            print(file=file)
+        return
+    
+    if verify:
+        errors = 0
+        for input in inputs or (None,):
+            if input is None:
+                errors += verify_dump(stdin.buffer, jobs=jobs)
+            else:
+                with open(input, "rb") as stream:
+                    errors += verify_dump(stream, jobs=jobs)
+        if errors:
+            raise SystemExit(f"{errors} corrupt records")
+        return
+    
+    if deltify or undeltify:
+        if len(inputs) > 1:
+            raise SystemExit("Converting takes a single input")
+        with ExitStack() as cleanup:
+            if inputs:
+                [input] = inputs
+                stream = cleanup.enter_context(open(input, "rb"))
+            else:
+                stream = stdin.buffer
+            if deltify and not stream.seekable():
+                raise SystemExit("Deltifying needs a seekable input")
+            if output is None:
+                if undeltify:
+                    raise SystemExit('Undeltifying requires "--output"')
+                file = stdout.buffer
+            else:
+                file = cleanup.enter_context(open(output, "w+b"))
+            convert_deltas(stream, file, deltify=deltify,
+                cache_size=int(cache_mb * 1e6))
+        return
+    
+    if split_revs is not None or split_path:
+        if output is None:
+            raise SystemExit('Splitting requires "--output"')
+        if len(inputs) > 1:
+            raise SystemExit("Splitting takes a single input")
+        with ExitStack() as cleanup:
+            if inputs:
+                [input] = inputs
+                stream = cleanup.enter_context(open(input, "rb"))
+            else:
+                stream = stdin.buffer
+            split_dump(stream, output, revs=split_revs, paths=split_path)
+        return
+    
     if log:
         with open(log, "rb") as log:
             copies = dict()
@@ -39,6 +167,10 @@ def main(
             dumps.append({"stream": stream})
         if not dumps:
             dumps = ({"stream": stdin.buffer},)
+        if output is None:
+            file = stdout.buffer
+        else:
+            file = cleanup.enter_context(open(output, "wb"))
         
         out_version = None
         for dump in dumps:
@@ -50,55 +182,706 @@ def main(
             else:
                 out_version = max(out_version, dump["version"])
         version = ("SVN-fs-dump-format-version", format(out_version))
-        write_message_fields(stdout.buffer, (version,))
+        write_message_fields(file, (version,))
         
         out_uuid = None
-        out_record = None
-        end = False
         for dump in dumps:
             try:
                 [record, content] = read_record(dump["stream"])
-                uuid = record.get_all("UUID", ())
-                if uuid:
-                    if dump["version"] < 2:
-                        warn(f"{dump['stream'].name}: UUID record only "
-                            "expected in version >= 2")
-                    [uuid] = uuid
-                    if out_uuid is None:
-                        out_uuid = uuid
-                    elif out_uuid != uuid:
-                        warn(f"{dump['stream'].name}: Conflicting UUID {uuid}; "
-                            f"expected {out_uuid}")
-                    [record, content] = read_record(dump["stream"])
-            
-                assert content is not None
-                if out_record is None:
-                    out_record = record
-                    out_content = content
-                elif (record.items() != out_record.items() or
-                        content != out_content):
-                    new_record = email.message.Message()
-                    for field in ("Revision-number", "Prop-content-length",
-                            "Content-length"):
-                        values = out_record.get_all(field, ())
-                        if (record.get_all(field, ()) != values):
-                            warn(f"{dump['stream'].name}: Conflicting "
-                                f"{field} field")
-                        for value in values:
-                            new_record[field] = value
-                    out_record = new_record
-                    if content != out_content:
-                        warn(f"{dump['stream'].name}: Conflicting content")
             except EOFError:
-                end = True
+                dump["next"] = None
+                continue
+            uuid = record.get_all("UUID", ())
+            if uuid:
+                if dump["version"] < 2:
+                    warn(f"{dump['stream'].name}: UUID record only "
+                        "expected in version >= 2")
+                [uuid] = uuid
+                if out_uuid is None:
+                    out_uuid = uuid
+                elif out_uuid != uuid:
+                    warn(f"{dump['stream'].name}: Conflicting UUID {uuid}; "
+                        f"expected {out_uuid}")
+                dump["uuid"] = uuid
+                try:
+                    dump["next"] = read_raw_record(dump["stream"])
+                except EOFError:
+                    dump["next"] = None
+                continue
+            dump["next"] = (record, None, content)
         
         if out_uuid is not None and out_version >= 2:
-            write_message_fields(stdout.buffer, (("UUID", out_uuid),))
-        if not end:
-            generator = email.generator.BytesGenerator(stdout.buffer,
-                mangle_from_=False)
-            generator.flatten(out_record)
-            stdout.buffer.write(out_content)
+            write_message_fields(file, (("UUID", out_uuid),))
+        merge_dumps(dumps, file)
+
+def merge_dumps(dumps, output):
+    """Interleaves the remaining records of each dump by revision
+    
+    Each dump's "next" item holds its next revision record, the
+    record's original bytes if known, and its content, or None at the
+    end of the dump."""
+    
+    heap = list()
+    for [i, dump] in enumerate(dumps):
+        if dump["next"] is not None:
+            heap.append((_revision_number(dump), i))
+    heapq.heapify(heap)
+    while heap:
+        [rev, i] = heapq.heappop(heap)
+        group = [i]
+        while heap and heap[0][0] == rev:
+            group.append(heapq.heappop(heap)[1])
+        group.sort()
+        
+        merge_revision([dumps[i] for i in group], output)
+        written = dict()  # Nodes from earlier dumps, by path
+        for i in group:
+            dump = dumps[i]
+            nodes = defaultdict(list)
+            for node in iter_nodes(dump):
+                [path] = node.record.get_all("Node-path")
+                earlier = written.get(path)
+                if earlier is not None:
+                    if any(node.same(other) for other in earlier):
+                        continue  # Identical node already written
+                    warn(f"{dump['stream'].name}: Conflicting node "
+                        f"{path} in r{rev}")
+                nodes[path].append(node)
+                node.write((output,))
+            for [path, path_nodes] in nodes.items():
+                written.setdefault(path, list()).extend(path_nodes)
+            if dump["next"] is not None:
+                next = _revision_number(dump)
+                if next <= rev:
+                    raise ValueError(f"{dump['stream'].name}: r{next} "
+                        f"after r{rev}")
+                heapq.heappush(heap, (next, i))
+
+def _revision_number(dump):
+    [record, _, _] = dump["next"]
+    [rev] = record.get_all("Revision-number")
+    return int(rev)
+
+def merge_revision(dumps, output):
+    """Writes the revision record, which should be the same in each dump
+    
+    Records are compared by hashing, so that only one record's content
+    is held at a time. Where they conflict, only the fields that
+    determine the record's size are kept."""
+    
+    [out_record, raw, out_content] = dumps[0]["next"]
+    out_digest = record_digest(out_record, out_content)
+    for dump in dumps[1:]:
+        [record, _, content] = dump["next"]
+        if record_digest(record, content) == out_digest:
+            continue
+        raw = None
+        new_record = email.message.Message()
+        for field in ("Revision-number", "Prop-content-length",
+                "Content-length"):
+            values = out_record.get_all(field, ())
+            if (record.get_all(field, ()) != values):
+                warn(f"{dump['stream'].name}: Conflicting "
+                    f"{field} field")
+            for value in values:
+                new_record[field] = value
+        out_record = new_record
+        if content != out_content:
+            warn(f"{dump['stream'].name}: Conflicting content")
+    if raw is None:
+        write_record(output, out_record, out_content)
+    else:
+        write_raw(output, raw, out_content)
+
+def record_digest(record, content):
+    digest = sha1()
+    for [name, value] in record.items():
+        digest.update(f"{name}: {value}\n".encode("utf-8"))
+    if content is not None:
+        digest.update(b"\n")
+        digest.update(content)
+    return digest.digest()
+
+def iter_nodes(dump):
+    """Yields node records up to the next revision record
+    
+    The next revision record is stored in the dump's "next" item.
+    Version and UUID records of concatenated dumps are skipped."""
+    
+    stream = dump["stream"]
+    while True:
+        try:
+            [record, raw] = read_raw_header(stream)
+        except EOFError:
+            dump["next"] = None
+            return
+        if "Node-path" in record:
+            node = Node(stream, record, raw)
+            yield node
+            node.skip()
+            continue
+        content = read_content(stream, record)
+        if "Revision-number" in record:
+            dump["next"] = (record, raw, content)
+            return
+        uuid = record.get_all("UUID", ())
+        if uuid and uuid != [dump.get("uuid", uuid[0])]:
+            warn(f"{stream.name}: Conflicting UUID {uuid[0]}")
+        elif not uuid:
+            assert "SVN-fs-dump-format-version" in record
+
+class Node:
+    """Node record whose content is copied straight from the input
+    
+    The header is written as it was read, and the content is copied
+    by offset, so that it is not held in memory, unless the input
+    cannot seek."""
+    
+    def __init__(self, stream, record, raw):
+        self.stream = stream
+        self.record = record
+        self.raw = raw
+        self.length = int(record.get("Content-length", 0))
+        self._digest = None
+        if stream.seekable():
+            self.offset = stream.tell()
+            self.content = None
+        else:
+            self.offset = None
+            self.content = read_content(stream, record)
+    
+    def write(self, files):
+        for file in files:
+            file.write(self.raw)
+            if self.offset is None:
+                if self.content is not None:
+                    file.write(self.content)
+            else:
+                self.stream.seek(self.offset)
+                copy_stream(self.stream, file, self.length)
+            if self.length:
+                file.write(b"\n")
+        if self.offset is None:
+            # Only keep the digest to compare with other dumps
+            self.digest()
+            self.content = None
+    
+    def skip(self):
+        if self.offset is not None:
+            self.stream.seek(self.offset + self.length)
+    
+    def same(self, other):
+        return self.raw == other.raw and self.length == other.length \
+            and self.digest() == other.digest()
+    
+    def digest(self):
+        if self._digest is not None:
+            return self._digest
+        digest = sha1()
+        if self.offset is None:
+            digest.update(self.content or b"")
+        else:
+            pos = self.stream.tell()
+            self.stream.seek(self.offset)
+            remaining = self.length
+            while remaining:
+                chunk = self.stream.read(min(remaining, 0x100000))
+                if not chunk:
+                    raise EOFError()
+                digest.update(chunk)
+                remaining -= len(chunk)
+            self.stream.seek(pos)
+        self._digest = digest.digest()
+        return self._digest
+
+def read_raw_record(stream):
+    [record, raw] = read_raw_header(stream)
+    return (record, raw, read_content(stream, record))
+
+def write_raw(file, raw, content):
+    file.write(raw)
+    if content is not None:
+        file.write(content)
+        file.write(b"\n")
+
+def write_record(file, record, content):
+    email.generator.BytesGenerator(file, mangle_from_=False).flatten(record)
+    if content is not None:
+        file.write(content)
+        file.write(b"\n")
+
+def dump_stats(stream, *, depth=2, rev_range=1000, top=20):
+    """Aggregates record sizes in one pass, skipping content
+    
+    Returns a dictionary suitable for JSON. Node sizes are aggregated
+    by the first "depth" components of their paths, and all sizes by
+    ranges of "rev_range" revisions. The "top" largest revisions are
+    also listed."""
+    
+    totals = _Sizes()
+    prefixes = defaultdict(_Sizes)
+    ranges = defaultdict(_Sizes)
+    revisions = dict()
+    rev = None
+    while True:
+        try:
+            record = read_header(stream)
+        except EOFError:
+            break
+        length = skip_content(stream, record)
+        if "Revision-number" in record:
+            rev = int(record["Revision-number"])
+            revisions[rev] = length
+            for sizes in (totals, ranges[rev // rev_range]):
+                sizes.revisions += 1
+                sizes.bytes += length
+        elif "Node-path" not in record:
+            continue  # Version or UUID header
+        else:
+            revisions[rev] += length
+            path = record["Node-path"].split("/")[:depth]
+            for sizes in (totals, prefixes["/".join(path)],
+                    ranges[rev // rev_range]):
+                sizes.add_node(record, length)
+    
+    largest = heapq.nlargest(top, revisions.items(),
+        key=lambda item: item[1])
+    return {
+        "totals": totals.report(),
+        "prefixes": {prefix: sizes.report()
+            for [prefix, sizes] in sorted(prefixes.items())},
+        "revision ranges": [
+            dict(start=i * rev_range, end=(i + 1) * rev_range - 1,
+                **sizes.report())
+            for [i, sizes] in sorted(ranges.items())
+        ],
+        "largest revisions": [dict(revision=rev, bytes=size)
+            for [rev, size] in largest],
+    }
+
+class _Sizes:
+    def __init__(self):
+        self.revisions = 0
+        self.nodes = 0
+        self.bytes = 0
+        self.prop_bytes = 0
+        self.full_text_bytes = 0
+        self.delta_bytes = 0
+        self.actions = defaultdict(int)
+    
+    def add_node(self, record, length):
+        self.nodes += 1
+        self.bytes += length
+        self.actions[record.get("Node-action")] += 1
+        self.prop_bytes += int(record.get("Prop-content-length", 0))
+        text = int(record.get("Text-content-length", 0))
+        if record.get("Text-delta") == "true":
+            self.delta_bytes += text
+        else:
+            self.full_text_bytes += text
+    
+    def report(self):
+        text = self.full_text_bytes + self.delta_bytes
+        report = {
+            "nodes": self.nodes,
+            "content bytes": self.bytes,
+            "property bytes": self.prop_bytes,
+            "full text bytes": self.full_text_bytes,
+            "delta bytes": self.delta_bytes,
+            "delta ratio": self.delta_bytes / text if text else None,
+            "actions": dict(self.actions),
+        }
+        if self.revisions:
+            report["revisions"] = self.revisions
+        return report
+
+def verify_dump(stream, *, jobs=None, batch_size=0x400000):
+    """Prints the problems found in each record, and returns the count
+    
+    The records are read in this process, and checked in a pool of
+    worker processes. Workers read the content of a seekable file for
+    themselves, so only the headers pass between processes."""
+    
+    filename = getattr(stream, "name", None)
+    if not stream.seekable() or not isinstance(filename, str) \
+            or not os.path.isfile(filename):
+        filename = None
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    errors = 0
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = deque()
+        batch = list()
+        batch_bytes = 0
+        rev = None
+        
+        def report(future):
+            nonlocal errors
+            for [rev, path, error] in future.result():
+                errors += 1
+                location = f"r{rev}" if path is None else f"r{rev} {path}"
+                print(f"{stream.name}: {location}: {error}", flush=True)
+        
+        while True:
+            try:
+                record = read_header(stream)
+            except EOFError:
+                break
+            except AssertionError:
+                errors += 1
+                print(f"{stream.name}: after r{rev}: Malformed header",
+                    flush=True)
+                break
+            if "Revision-number" in record:
+                rev = record["Revision-number"]
+            path = record.get("Node-path")
+            length = record.get("Content-length")
+            length = 0 if length is None else int(length)
+            if filename is None:
+                content = stream.read(length)
+                offset = None
+            else:
+                offset = stream.tell()
+                skip_content(stream, record)
+                content = None
+            batch.append((rev, path, record.items(), offset, length, content))
+            batch_bytes += length
+            if batch_bytes >= batch_size or len(batch) >= 1000:
+                pending.append(executor.submit(verify_records, filename,
+                    batch))
+                batch = list()
+                batch_bytes = 0
+                # Bound the memory used by results and content in transit
+                while len(pending) > jobs * 2:
+                    report(pending.popleft())
+        if batch:
+            pending.append(executor.submit(verify_records, filename, batch))
+        while pending:
+            report(pending.popleft())
+    return errors
+
+_verify_files = dict()
+
+def verify_records(filename, records):
+    """Returns (rev, path, error) for each problem in a batch of records"""
+    errors = list()
+    for [rev, path, items, offset, length, content] in records:
+        if content is None:
+            file = _verify_files.get(filename)
+            if file is None:
+                file = open(filename, "rb")
+                _verify_files[filename] = file
+            file.seek(offset)
+            content = file.read(length)
+        for error in verify_record(items, content, length):
+            errors.append((rev, path, error))
+    return errors
+
+def verify_record(items, content, length):
+    header = email.message.Message()
+    for [name, value] in items:
+        header[name] = value
+    if content is not None and len(content) < length:
+        yield "Truncated content"
+        return
+    
+    lengths = [header.get(name) for name in
+        ("Prop-content-length", "Text-content-length")]
+    total = sum(int(n) for n in lengths if n is not None)
+    if "Content-length" in header and total != length:
+        yield (f"Content-length {length} does not match "
+            f"property and text lengths totalling {total}")
+        return
+    if content is None:
+        content = b""
+    try:
+        [_, text] = parse_content(header, content)
+    except UnicodeDecodeError:
+        yield "Property value is not UTF-8"
+        return
+    except (AssertionError, ValueError):
+        yield "Malformed property block"
+        return
+    if text is None or header.get("Text-delta") == "true":
+        return
+    for [name, hash] in (
+        ("Text-content-md5", md5),
+        ("Text-content-sha1", sha1),
+    ):
+        expected = header.get(name)
+        if expected is not None and hash(text).hexdigest() != expected:
+            yield f"{name} mismatch"
+
+def convert_deltas(stream, output, *, deltify, cache_size=64000000):
+    """Copies a dump, converting between text deltas and full texts
+    
+    When deltifying, the previous texts are read back from the input,
+    otherwise from the output. Other records are copied unchanged."""
+    
+    history = ContentHistory(cache_size)
+    [record, raw] = read_raw_header(stream)
+    assert "SVN-fs-dump-format-version" in record
+    if deltify:
+        # Deltas are only allowed from version 3
+        write_message_fields(output, (("SVN-fs-dump-format-version", "3"),))
+    else:
+        output.write(raw)
+    rev = None
+    while True:
+        try:
+            [record, raw] = read_raw_header(stream)
+        except EOFError:
+            break
+        path = record.get("Node-path")
+        if path is None:
+            if "Revision-number" in record:
+                rev = int(record["Revision-number"])
+            elif "SVN-fs-dump-format-version" in record:
+                read_content(stream, record)
+                continue  # Header of a concatenated dump
+            write_raw(output, raw, read_content(stream, record))
+            continue
+        
+        action = record["Node-action"]
+        if action in {"delete", "replace"}:
+            history.delete(path, rev)
+        source = record.get("Node-copyfrom-path")
+        if source is not None:
+            history.copy(path, rev, source, int(record["Node-copyfrom-rev"]))
+        
+        text_length = record.get("Text-content-length")
+        if text_length is None or record.get("Node-kind") == "dir":
+            node = Node(stream, record, raw)
+            node.write((output,))
+            node.skip()
+            continue
+        
+        props = stream.read(int(record.get("Prop-content-length", 0)))
+        offset = stream.tell() if deltify else None
+        text = stream.read(int(text_length))
+        assert len(text) == int(text_length)
+        base = history.get(path, rev)
+        delta = record.get("Text-delta") == "true"
+        if deltify:
+            if delta:
+                raise ValueError(f"{stream.name}: r{rev} {path} "
+                    "is already a delta")
+            history.file(path, rev, (stream, offset, len(text)))
+            text = encode_svndiff(base, text)
+            record = _text_header(record, text, delta_base=base)
+        elif delta:
+            text = bytes(apply_svndiff(base, text))
+            expected = record.get("Text-content-md5")
+            if expected is not None and md5(text).hexdigest() != expected:
+                raise ValueError(f"{stream.name}: r{rev} {path} "
+                    "checksum mismatch")
+            record = _text_header(record, text)
+        
+        if deltify or delta:
+            email.generator.BytesGenerator(output,
+                mangle_from_=False).flatten(record)
+        else:
+            output.write(raw)
+        output.write(props)
+        if not deltify:
+            history.file(path, rev, (output, output.tell(), len(text)))
+        output.write(text)
+        output.write(b"\n")
+
+def _text_header(record, text, *, delta_base=False):
+    """Returns a copy of a node header for new text content
+    
+    If "delta_base" is given, the text is a delta against it, or
+    against the empty text if it is None."""
+    
+    header = email.message.Message()
+    for [name, value] in record.items():
+        if name not in {"Text-delta", "Text-delta-base-md5",
+                "Text-delta-base-sha1", "Text-content-length",
+                "Content-length"}:
+            header[name] = value
+    if delta_base is not False:
+        header["Text-delta"] = "true"
+        if delta_base is not None:
+            header["Text-delta-base-md5"] = md5(delta_base).hexdigest()
+    props = int(record.get("Prop-content-length", 0))
+    header["Text-content-length"] = format(len(text))
+    header["Content-length"] = format(props + len(text))
+    return header
+
+class ContentHistory:
+    """Locates the texts of files by path and revision
+    
+    A file's location is a (file, offset, length) tuple. Deleting or
+    copying a directory is recorded once, against the directory path.
+    Texts are read back through a cache of at most "cache_size" bytes,
+    dropping the least recently used."""
+    
+    def __init__(self, cache_size):
+        self.events = dict()
+        self.seq = 0
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cached = 0
+    
+    def file(self, path, rev, location):
+        self._add(path, rev, ("file", location))
+    
+    def copy(self, path, rev, source, source_rev):
+        self._add(path, rev, ("copy", source, source_rev))
+    
+    def delete(self, path, rev):
+        self._add(path, rev, None)
+    
+    def _add(self, path, rev, event):
+        # Events in the same revision are ordered by a sequence number
+        self.seq += 1
+        [keys, events] = self.events.setdefault(path, (list(), list()))
+        keys.append((rev, self.seq))
+        events.append(event)
+    
+    def get(self, path, rev):
+        """Returns the text of a file, or None if it does not exist"""
+        location = self._find(path, rev)
+        if location is None:
+            return None
+        data = self.cache.get(location)
+        if data is not None:
+            self.cache.move_to_end(location)
+            return data
+        [file, offset, length] = location
+        pos = file.tell()
+        file.seek(offset)
+        data = file.read(length)
+        assert len(data) == length
+        file.seek(pos)
+        self.cache[location] = data
+        self.cached += length
+        while self.cached > self.cache_size:
+            [_, evicted] = self.cache.popitem(last=False)
+            self.cached -= len(evicted)
+        return data
+    
+    def _find(self, path, rev):
+        """Returns the location of a file's text, following copies"""
+        
+        # Find the latest event for the path or any of its parents
+        latest = None
+        key = (rev, float("inf"))
+        parent = path
+        while True:
+            history = self.events.get(parent)
+            if history is not None:
+                [keys, events] = history
+                i = bisect_right(keys, key)
+                if i and (latest is None or keys[i - 1] > latest[0]):
+                    latest = (keys[i - 1], events[i - 1], parent)
+            if not parent:
+                break
+            parent = parent.rpartition("/")[0]
+        
+        if latest is None:
+            return None
+        [_, event, parent] = latest
+        if event is None:
+            return None
+        if event[0] == "copy":
+            [_, source, source_rev] = event
+            return self._find(source + path[len(parent):], source_rev)
+        if parent != path:
+            return None  # A file event does not apply to other paths
+        return event[1]
+
+def split_dump(stream, template, *, revs=None, paths=()):
+    """Writes parts of a dump to files named by template.format(i)
+    
+    Revision 0 goes with the first part of a split by revision. For a
+    split by path, a directory node goes to each part with paths under
+    it, so that every part can be loaded by itself."""
+    
+    [record, _] = read_record(stream)
+    [version] = record.get_all("SVN-fs-dump-format-version")
+    headers = [("SVN-fs-dump-format-version", version)]
+    filters = [PathFilter(include=(path,)) for path in paths]
+    
+    files = dict()
+    try:
+        current = None
+        while True:
+            try:
+                [record, raw] = read_raw_header(stream)
+            except EOFError:
+                break
+            if "Node-path" in record:
+                if filters:
+                    [path] = record.get_all("Node-path")
+                    current = _split_parts(filters, path,
+                        record.get("Node-kind"))
+                    source = record.get("Node-copyfrom-path")
+                    if source is not None and not current >= _split_parts(
+                            filters, source, record.get("Node-kind")):
+                        warn(f"{stream.name}: Copy of {path} from "
+                            f"{source} crosses split dumps")
+                node = Node(stream, record, raw)
+                node.write(files[i] for i in current)
+                node.skip()
+                continue
+            
+            content = read_content(stream, record)
+            if "Revision-number" in record:
+                if not files and filters:
+                    for i in range(len(filters) + 1):
+                        files[i] = _open_split(template, i, headers)
+                if filters:
+                    current = files.keys()
+                else:
+                    [rev] = record.get_all("Revision-number")
+                    i = max(int(rev) - 1, 0) // revs
+                    if i not in files:
+                        for file in files.values():
+                            file.close()
+                        files.clear()
+                        files[i] = _open_split(template, i, headers)
+                    current = (i,)
+            else:
+                uuid = record.get_all("UUID")
+                if uuid and not files:
+                    headers.append(("UUID", uuid[0]))
+                continue  # Header of a concatenated dump
+            
+            for i in current:
+                write_raw(files[i], raw, content)
+    finally:
+        for file in files.values():
+            file.close()
+
+def _open_split(template, i, headers):
+    file = open(template.format(i), "wb")
+    try:
+        for header in headers:
+            write_message_fields(file, (header,))
+    except:
+        file.close()
+        raise
+    return file
+
+def _split_parts(filters, path, kind):
+    """Returns the set of parts that a node belongs to
+    
+    Deletions do not have a kind, so they are treated like directories."""
+    
+    parts = set()
+    dir = kind != "file"
+    selected = False
+    for [i, filter] in enumerate(filters):
+        if filter.selected(path):
+            parts.add(i)
+            selected = True
+        elif dir and filter.touches(path):
+            parts.add(i)
+    if not selected:
+        parts.add(len(filters))
+    return parts
 
 def write_message_fields(file, headers):
     msg = email.message.Message()
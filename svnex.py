@@ -11,20 +11,28 @@ from subprocess import Popen
 import subprocess
 from errno import EPIPE
 from contextlib import contextmanager
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from bisect import bisect_right, bisect_left
-from contextlib import closing
+from contextlib import closing, ExitStack, nullcontext
 #~ from subvertpy.properties import parse_mergeinfo_property
 #~ from subvertpy.properties import generate_mergeinfo_property
 from misc import Context
 from xml.etree import ElementTree
-from _common import parse_path, read_record
+from _common import parse_path, read_header, read_content
+from _common import skip_content, PathFilter, copy_stream, apply_svndiff
+from _common import parse_content, parse_props
+import _common
 from datetime import datetime, timezone
-from io import BytesIO
 from hashlib import md5
+from time import perf_counter, monotonic
+import json
+import revmap
+from revmap import RevMap
+
+PROP_MERGEINFO = b"svn:mergeinfo"
 
 def main(
-    dump: dict(help="Subversion dump filename"),
+    dump: dict(help='Subversion dump filename, or "-" for stdin'),
     branch: dict(metavar="/path[@rev]", help="Subversion branch"),
     importer: dict(mutex_required="output",
         help="command to pipe fast import stream to") = (),
@@ -36,18 +44,45 @@ def main(
     rev_map: dict(metavar="FILENAME",
         help="""file mapping from Subversion paths and revisions
         to existing Git revisions,
-        each line formatted as PATH@SVN-REV (space) GIT-REV""") = None,
+        each line formatted as PATH@SVN-REV (space) GIT-REV,
+        or in the binary format written by revmap.py""") = None,
     authors_file: dict(short="-A", metavar="FILENAME", help=
         'file mapping Subversion user names to Git authors, like "git-svn"')
         = None,
     rewrite_root: dict(metavar="URL",
         help="Subversion URL to store in the metadata") = "",
     git_svn: dict(help="include git-svn-id lines") = False,
-    ignore: dict(
-        metavar="PATH", help="add a path to be excluded from export") = (),
+    ignore: dict(metavar="PATH", help="""add a path to be excluded from
+        export, which may be a glob pattern""") = (),
+    include: dict(metavar="PATH", help="""only export paths under this
+        path, which may be a glob pattern""") = (),
     export_copies: dict(help='''export simple branch copies even when no
         files were modified''') = False,
     quiet: dict(short="-q", help="suppress progress messages") = False,
+    verbose_log: dict(metavar="FILENAME",
+        help="list each exported node in this file") = None,
+    stats: dict(help="print a summary of the time spent in each phase")
+        = False,
+    stats_interval: dict(type=float, metavar="SECONDS", help="""print a
+        machine-readable stats line at most this often""") = None,
+    profile_revs: dict(metavar="START:END", help="""with "--profile",
+        only profile the commits of this revision range""") = None,
+    log: dict(mutex="log", metavar="FILENAME",
+        help='"svn log --xml -v" output (default: stdin)') = None,
+    log_from_dump: dict(mutex="log", help="""derive the changed paths from
+        the dump, instead of reading "svn log --xml -v" output""")
+        = False,
+    checkpoint_commits: dict(type=int, metavar="N", help="""send a
+        "checkpoint" command to fast-import after this many commits""")
+        = None,
+    checkpoint_mb: dict(type=float, metavar="MB", help="""send a
+        "checkpoint" command after this much output""") = None,
+    state: dict(metavar="FILENAME", help="""at each checkpoint, append the
+        exported revisions to this file, in the "--rev-map" format,
+        so that an interrupted conversion can be resumed""") = None,
+    memory_budget: dict(type=int, metavar="BYTES", help="""copy full
+        texts larger than this straight from the dump to the output, in
+        chunks of at most this size""") = None,
 ):
     '''Converts a Subversion repository to Git's "fast-import" format
     
@@ -60,6 +95,10 @@ def main(
     * be run incrementally???
     * handle Subversion merge tracking information
     
+    The dump is read sequentially, so it may be piped from "svnadmin
+    dump" or "svnrdump" while it is being produced, with the log given
+    by "--log".
+    
     It does not (yet):
     
     * handle or correlate multiple trunks, branches, or tags
@@ -79,15 +118,6 @@ def main(
     [branch] = branch
     branch = branch.lstrip("/")
     
-    rev_map_data = defaultdict(dict)
-    if rev_map is not None:
-        with open(rev_map, "rt") as file:
-            for s in file:
-                (s, gitrev) = s.rstrip("\n").rsplit(" ", 1)
-                (branch, svnrev) = s.rsplit("@", 1)
-                svnrev = int(svnrev)
-                rev_map_data[branch][svnrev] = gitrev
-    
     if authors_file is not None:
         author_map = dict()
         with open(authors_file, "rt") as f:
@@ -99,68 +129,142 @@ def main(
     else:
         author_map = None
     
+    profiler = _common.profiler
+    if profile_revs is not None:
+        if profiler is None:
+            raise SystemExit('"--profile-revs" requires "--profile"')
+        [start, end] = profile_revs.split(":")
+        profile_revs = (int(start), int(end))
+        profiler.disable()
+    
+    if dump == "-" and log is None:
+        if log_from_dump:
+            raise SystemExit('"--log-from-dump" cannot read the dump '
+                'from stdin')
+        raise SystemExit('Reading the dump from stdin requires "--log"')
+    
+    if state is not None and not importer:
+        raise SystemExit('"--state" requires a fast-import command')
+    if checkpoint_mb is not None:
+        checkpoint_bytes = int(checkpoint_mb * 1e6)
+    else:
+        checkpoint_bytes = None
+    
+    stats_data = Stats(stats_interval,
+        timing=stats or stats_interval is not None)
     if importer:
-        output = FastExportPipe(importer)
+        output = FastExportPipe(importer, stats=stats_data)
     else:
-        output = FastExportFile(file)
-    with output, open(dump, "rb") as dump:
+        output = FastExportFile(file, stats=stats_data)
+    with ExitStack() as cleanup:
+        cleanup.enter_context(output)
+        if rev_map is None:
+            rev_map_data = RevMap()
+        else:
+            rev_map_data = cleanup.enter_context(revmap.load(rev_map))
+        if dump == "-":
+            dump = stdin.buffer
+        else:
+            dump = cleanup.enter_context(open(dump, "rb"))
+        if verbose_log is not None:
+            verbose_log = cleanup.enter_context(open(verbose_log, "wt"))
+        if log_from_dump:
+            if not dump.seekable():
+                raise SystemExit('"--log-from-dump" needs a seekable dump')
+            svnlog = dump_log(dump)
+            dump.seek(0)
+        elif log is not None:
+            svnlog = ElementTree.parse(log).getroot()
+        else:
+            svnlog = None
+        if state is not None:
+            state = cleanup.enter_context(open(state, "at"))
         exporter = Exporter(dump, output,
             rev_map=rev_map_data,
             author_map=author_map,
             root=rewrite_root,
-            ignore=ignore,
+            ignore=ignore, include=include,
             git_svn=git_svn, export_copies=export_copies,
-            quiet=quiet,
+            quiet=quiet, verbose_log=verbose_log,
+            profiler=profiler, profile_revs=profile_revs,
+            svnlog=svnlog,
+            checkpoint_commits=checkpoint_commits,
+            checkpoint_bytes=checkpoint_bytes, state=state,
+            memory_budget=memory_budget,
         )
         exporter.export(git_ref, branch, peg_rev)
+    if stats:
+        stats_data.summary()
 
 class Exporter:
     def __init__(self, dump, output,
         rev_map={},
         author_map=None,
         root="",
-        ignore=(),
+        ignore=(), include=(),
         git_svn=False, export_copies=False,
-        quiet=False,
+        quiet=False, verbose_log=None,
+        profiler=None, profile_revs=None,
+        svnlog=None,
+        checkpoint_commits=None, checkpoint_bytes=None, state=None,
+        memory_budget=None,
     ):
+        """If "svnlog" is not given, the XML log is read from stdin"""
         self.output = output
+        self.checkpoint_commits = checkpoint_commits
+        self.checkpoint_bytes = checkpoint_bytes
+        self.state = state
+        self.memory_budget = memory_budget
+        self.unsaved = list()
+        self.checkpoint_revs = 0
+        self.checkpoint_output = 0
+        self.profiler = profiler
+        self.profile_revs = profile_revs
         self.author_map = author_map
-        self.ignore = ignore
+        self.filter = PathFilter(include, ignore)
         self.git_svn = git_svn
         self.export_copies = export_copies
         
-        self.known_branches = defaultdict(lambda: (list(), list()))
-        for (branch, revs) in rev_map.items():
-            branch = branch.lstrip("/")
-            (starts, runs) = self.known_branches[branch]
-            start = None
-            run = ()
-            for (svnrev, gitrev) in sorted(revs.items()):
-                if svnrev - len(run) != start:
-                    start = svnrev
-                    starts.append(start)
-                    run = list()
-                    runs.append(run)
-                run.append(gitrev)
+        if isinstance(rev_map, RevMap):
+            self.known_branches = rev_map
+        else:
+            self.known_branches = RevMap(rev_map)
         
         self.quiet = quiet
         if self.quiet:
             self.progress = dummycontext
+            self.nodes = NodeProgress(None, verbose_log)
         else:
             self.progress = progresscontext
+            self.nodes = NodeProgress(stderr, verbose_log)
         
         with self.progress("loading log:"):
-            self._svnlog = ElementTree.parse(stdin.buffer).getroot()
+            if svnlog is None:
+                svnlog = ElementTree.parse(stdin.buffer).getroot()
+            self._svnlog = svnlog
             first = self._svnlog[0].get("revision")
             last = self._svnlog[-1].get("revision")
             self.log(f" r{first}:{last}")
         
         self.root = root
+        self.reachability = Reachability()
+        self.locations = LocationCache()
+        
+        # Only the history of paths that are later copied is kept
+        self.copy_sources = set()
+        for path in self._svnlog.iterfind("logentry/paths/path"):
+            source = path.get("copyfrom-path")
+            if source is not None:
+                self.copy_sources.add(source.strip("/"))
+        self.history = FileHistory()
+        # Branch prefixes whose history is complete from a revision
+        self.history_starts = dict()
         
         self.dump = dump
-        [header, content] = read_record(dump)
+        self.stats = output.stats
+        [header, content] = self._read_record()
         assert header.keys() == ["SVN-fs-dump-format-version"]
-        [header, content] = read_record(dump)
+        [header, content] = self._read_record()
         [[field, self.uuid]] = header.items()
         assert field == "UUID"
         self._header = None
@@ -172,13 +276,22 @@ class Exporter:
         (base_rev, base_path) = segments.base
         if base_rev:
             gitrev = segments.git_base
+            if gitrev is not None and not gitrev.startswith(":"):
+                # Resuming from a commit that was not exported by this
+                # process, so its files are only known to the importer
+                self.output.reset(gitrev)
         else:
             gitrev = None
         
         init_export = True
+        complete = not base_rev
         for (base, end, path) in segments:
             path = "/" + path
             prefix = path.rstrip("/") + "/"
+            if complete:
+                # Every revision of the branch's first location is read
+                self.history_starts.setdefault(prefix, base)
+                complete = False
             with iter_revs(self, path, base, end) as revs:
                 for (svnrev, date, author, self.paths) in revs:
                     commit = self.export_copies
@@ -196,12 +309,13 @@ class Exporter:
                         commit = src is None
                     
                     if commit:
-                        new = self.commit(svnrev, date, author,
-                            init_export=init_export,
-                            base_rev=base_rev, base_path=base_path,
-                            gitrev=gitrev,
-                            path=path, prefix=prefix,
-                        )
+                        with self.profiling(svnrev):
+                            new = self.commit(svnrev, date, author,
+                                init_export=init_export,
+                                base_rev=base_rev, base_path=base_path,
+                                gitrev=gitrev,
+                                path=path, prefix=prefix,
+                            )
                         if new:
                             gitrev = new
                             init_export = False
@@ -214,45 +328,82 @@ class Exporter:
                     base_path = path[1:]
                     
                     # Remember newly exported Git revision
-                    (svnstarts, gitruns) = self.known_branches[base_path]
-                    i = bisect_left(svnstarts, base_rev)
-                    if (i > 0 and
-                    svnstarts[i - 1] + len(gitruns[i - 1]) == base_rev):
-                        gitruns[i - 1].append(gitrev)
-                    else:
-                        svnstarts.insert(i, base_rev)
-                        gitruns.insert(i, [gitrev])
+                    self.known_branches.add(base_path, base_rev, gitrev)
+                    if gitrev is not None:
+                        self.checkpoint_revs += 1
+                        if self.state is not None:
+                            self.unsaved.append(
+                                (base_path, base_rev, gitrev))
+                    if self.checkpoint_due():
+                        self.checkpoint()
         
+        if self.state is not None and self.unsaved:
+            self.checkpoint()
         return gitrev
     
+    def checkpoint_due(self):
+        if self.checkpoint_commits is not None \
+                and self.checkpoint_revs >= self.checkpoint_commits:
+            return True
+        if self.checkpoint_bytes is None:
+            return False
+        output = self.stats.counts["output bytes"] - self.checkpoint_output
+        return output >= self.checkpoint_bytes
+    
+    def checkpoint(self):
+        """Has fast-import write out its state, then saves ours
+        
+        The state file only lists revisions that fast-import has
+        finished writing, so that it can be used as a revision map to
+        resume after a crash."""
+        
+        self.output.checkpoint()
+        if self.state is not None:
+            for [path, svnrev, gitrev] in self.unsaved:
+                if gitrev.startswith(":"):
+                    gitrev = self.output.get_mark(gitrev)
+                print(f"{path}@{svnrev} {gitrev}", file=self.state)
+            self.state.flush()
+        self.unsaved.clear()
+        self.checkpoint_revs = 0
+        self.checkpoint_output = self.stats.counts["output bytes"]
+    
     def commit(self, rev, date, author, *,
     init_export, base_rev, base_path, gitrev, path, prefix):
         self.log(":")
+        self.nodes.revision(rev)
         edits = list()
-        mergeinfo = dict()
+        mergeinfo = RevisionSet()
         
+        # Deleting or replacing a directory prunes its whole subtree
         for (file, (action, _, _)) in self.paths.items():
             if not file.startswith(prefix) or action not in "DR":
                 continue
             file = file[len(prefix):]
-            for p in self.ignore:
-                if file == p or file.startswith((p + "/").lstrip("/")):
-                    break
-            else:
-                dir.delete_entry(file)
+            if not self.filter.touches(file):
+                self._forget(prefix[1:] + file, rev)
+                continue
+            self.nodes.node("D", file)
+            self._deleted(prefix, file, rev)
+            edits.append(f"D {file}")
         
         r = None
         while True:
             if self._header is None:
-                [header, self._content] = read_record(self.dump)
+                header = self._read_header()
+                if "Node-path" in header:
+                    # Node of a revision that is not exported
+                    self._skip_content(header)
+                    continue
+                self._content = self._read_content(header)
             else:
                 header = self._header
                 self._header = None
             # Tolerate concatenated dumps
             if header.items() == [("SVN-fs-dump-format-version", "3")]:
-                [header, content] = read_record(self.dump)
+                [header, content] = self._read_record()
                 assert header.items() == [("UUID", self.uuid)]
-                [header, self._content] = read_record(self.dump)
+                [header, self._content] = self._read_record()
             if "Node-path" in header:
                 continue
             r = int(header["Revision-number"])
@@ -265,21 +416,35 @@ class Exporter:
         assert revprops.keys() <= {b"svn:author", b"svn:date", b"svn:log"}
         log = revprops[b"svn:log"]
         
-        for p in self.ignore:
-            reporter.set_path(p, INVALID_REVNUM, True, None,
-                subvertpy.ra.DEPTH_EXCLUDE)
-        
         while True:
-            [self._header, self._content] = read_record(self.dump)
+            try:
+                self._header = self._read_header()
+            except EOFError:
+                self._header = None
+                break
             p = self._header.get_all("Node-path")
             if not p:
+                self._content = self._read_content(self._header)
                 break
             
             [p] = p
             p = "/" + p
             [action, from_path, from_rev] = self.paths.pop(p)
-            if not p.startswith(prefix) and p != path:
+            # Filter on the path before reading the content
+            if p == path:
+                pass
+            elif not p.startswith(prefix) or action == "D" \
+                    or not self._wanted(p, prefix):
+                self._skip_content(self._header)
                 continue
+            text_length = self._streamed_length(self._header)
+            if text_length is None:
+                self._content = self._read_content(self._header)
+            else:
+                # Only read the properties; the text is copied later
+                length = self._header.get("Prop-content-length", "0")
+                with self.stats.timer("dump read"):
+                    self._content = self.dump.read(int(length))
             assert frozenset(self._header.keys()) < {
                 "Node-path", "Node-kind", "Node-action",
                 "Node-copyfrom-path", "Node-copyfrom-rev", "Prop-delta",
@@ -287,21 +452,80 @@ class Exporter:
                 "Prop-content-length", "Text-content-length",
                 "Content-length",
             }
-            assert action == {"add": "A", "change": "M"}[self._header.get("Node-action")]
-            assert from_path is from_rev is None
+            assert action == {"add": "A", "change": "M",
+                "delete": "D", "replace": "R"}[self._header.get("Node-action")]
+            if action == "D":
+                continue  # Already pruned from the file tree
+            if from_path is None or p == path:
+                copy = None
+            else:
+                copy = (from_path.lstrip("/"), int(from_rev))
             [kind] = self._header.get_all("Node-kind")
             if kind == "dir":
-                assert action == "A"
-                if not self.quiet:
-                    stderr.writelines(("\n  A ", p, "/"))
+                self.nodes.node(action, p + "/")
+                if p == path:
+                    [props, _] = parse_content(self._header, self._content)
+                    value = props.get(PROP_MERGEINFO)
+                    if value is not None:
+                        mergeinfo = parse_mergeinfo_property(value)
+                elif copy is not None:
+                    if not self._history_complete(*copy):
+                        raise LookupError("Copy source {}@{} not exported"
+                            .format(*copy))
+                    # Copy the whole subtree without any content
+                    dir = p[len(prefix):]
+                    for [name, entry] in sorted(self.history.walk(*copy)):
+                        file = f"{dir}/{name}"
+                        selected = self.filter.selected(file)
+                        self._changed(prefix, file, rev, entry,
+                            hidden=not selected)
+                        if selected:
+                            self.nodes.node("A", prefix + file)
+                            [blob, mode] = entry
+                            edits.append(f"M {mode} {blob} {file}")
             else:
                 assert kind == "file"
-                if not self.quiet:
-                    stderr.write(f"\n  {action} {p}")
                 p = p[len(prefix):]
-                [props, target] = parse_content(self._header, self._content)
-                if action == "M":
-                    [source, mode] = self.output[p]
+                # Files outside the filter are only kept as copy sources
+                hidden = not self.filter.selected(p)
+                if not hidden:
+                    self.nodes.node(action, prefix + p)
+                if text_length is None:
+                    [props, target] = parse_content(self._header,
+                        self._content)
+                else:
+                    props = dict()
+                    if "Prop-content-length" in self._header:
+                        props = parse_props(self._content)
+                    target = None
+                if copy is not None:
+                    entry = self.history.get(*copy)
+                    if entry is None:
+                        if text_length is None and (target is None or
+                                self._header.get("Text-delta") == "true"):
+                            raise LookupError(
+                                "Copy source {}@{} not exported"
+                                .format(*copy))
+                        # The full text is given, so treat it as added
+                        copy = None
+                        entry = (None, "644")
+                    [source, mode] = entry
+                    if props and self._header.get("Prop-delta") != "true":
+                        mode = props.get(b"svn:executable")
+                        mode = {None: "644", "*": "755"}[mode]
+                    if target is None and text_length is None:
+                        self._changed(prefix, p, rev, entry, hidden=hidden)
+                        if not hidden:
+                            edits.append(f"M {mode} {source} {p}")
+                        continue
+                elif action == "M":
+                    if hidden:
+                        entry = self.history.get(prefix[1:] + p, rev)
+                        if entry is None:
+                            raise LookupError(f"{prefix}{p} not exported")
+                        [source, mode] = entry
+                    else:
+                        [source, mode] = self.output[p]
                 else:
                     assert props.items() >= {(b"svn:eol-style", "native"),
                         (b"svn:keywords", "Author Date Id Revision")}
@@ -313,58 +537,31 @@ class Exporter:
                     mode = props.get(b"svn:executable")
                     mode = {None: "644", "*": "755"}[mode]
                 if self._header.get("Text-delta") == "true":
-                    if action == "M":
-                        source = self.output.cat_blob(source)
+                    if action == "M" or copy is not None:
+                        with self.stats.timer("cat-blob"):
+                            source = self.output.cat_blob(source)
                         [hash] = self._header.get_all("Text-delta-base-md5")
-                        assert md5(source).hexdigest() == hash
+                        with self.stats.timer("checksum"):
+                            assert md5(source).hexdigest() == hash
                     else:
                         source = None
-                    delta = BytesIO(target)
-                    header = delta.read(4)
-                    assert header == b"SVN\x00"
-                    source_offset = read_int(delta)
-                    assert source_offset == 0
-                    source_length = read_int(delta)
-                    target = read_int(delta)
-                    instr_length = read_int(delta)
-                    data = read_int(delta)
-                    instr_data = delta.read(instr_length)
-                    assert len(instr_data) == instr_length
-                    instr_data = BytesIO(instr_data)
-                    target = bytearray()
-                    while True:
-                        instr = instr_data.read(1)
-                        if not instr:
-                            break
-                        [instr] = instr
-                        copy = instr & 0x3F
-                        instr >>= 6
-                        if not copy:
-                            copy = read_int(instr_data)
-                        SOURCE = 0
-                        TARGET = 1
-                        NEW = 2
-                        if instr == SOURCE:
-                            offset = read_int(instr_data)
-                            data = source[offset:offset + copy]
-                        elif instr == TARGET:
-                            offset = read_int(instr_data)
-                            data = target[offset:offset + copy]
-                            # Repeat if length greater than existing target size
-                            data *= -(-copy // len(data))
-                            data = data[:copy]
-                        else:
-                            assert instr == NEW
-                            data = delta.read(copy)
-                        assert len(data) == copy
-                        target.extend(data)
-                    assert not delta.read(1)
+                    with self.stats.timer("delta"):
+                        target = apply_svndiff(source, target)
                     [hash] = self._header.get_all("Text-content-md5")
-                    assert md5(target).hexdigest() == hash
-                blob = self.output.blob(p, target)
-                self.output[p] = (blob, mode)
-                edits.append(f"M {mode} {blob} {p}")
-            stderr.flush()
+                    with self.stats.timer("checksum"):
+                        assert md5(target).hexdigest() == hash
+                # Hidden blobs are not entered in the file table
+                file = None if hidden else p
+                if text_length is None:
+                    blob = self.output.blob(file, target)
+                else:
+                    blob = self.output.blob_copy(file, self.dump,
+                        text_length, bufsize=self.memory_budget)
+                    self.stats.count("streamed bytes", text_length)
+                self._changed(prefix, p, rev, (blob, mode), hidden=hidden)
+                if not hidden:
+                    edits.append(f"M {mode} {blob} {p}")
+        self.nodes.finish()
         if not edits:
             self.log("\n  => commit skipped")
             return None
@@ -379,20 +576,13 @@ class Exporter:
             merged = RevisionSet()
             ancestors = Ancestors(self)
             merged.update(basehist)
-            mergeinfo = mergeinfo.items()
-            for (branch, ranges) in mergeinfo:
-                for (start, end, _) in ranges:
-                    merged.add_segment(branch, start, end)
-                    ancestors.add_natural(branch, end)
-            if merged != basehist and ancestors == merged:
-                # TODO: minimise so that only independent branch heads are listed
-                # i.e. do not explicitly merge C if also merging A and B, and C is an ancestor of both A and B
-                for (branch, ranges) in mergeinfo:
-                    branch = branch.lstrip("/")
-                    for (_, end, _) in ranges:
-                        ancestor = self.export(self.git_ref, branch, end)
-                        if ancestor is not None:
-                            merges.append(ancestor)
+            merged.union(mergeinfo)
+            for (branch, start, end) in mergeinfo:
+                ancestors.add_natural(branch, end)
+            # Only a complete merge of the natural history of each source is
+            # recorded as a Git merge; anything less is a cherry-pick
+            if merged != basehist and ancestors <= merged:
+                merges = self.merge_heads(mergeinfo, basehist, gitrev)
         
         self.output.printf("commit {}", self.git_ref)
         
@@ -415,7 +605,7 @@ class Exporter:
                 log, self.root, path.rstrip("/"), rev, self.uuid)
         log = log.encode("utf-8")
         self.output.printf("data {}", len(log))
-        self.output.file.write(log)
+        self.output.write(log)
         self.output.printf("")
         
         if (init_export or merges) and gitrev is not None:
@@ -427,13 +617,213 @@ class Exporter:
             self.output.printf("{}", line)
         self.output.printf("")
         
+        if gitrev is None:
+            parents = merges
+        else:
+            parents = [gitrev] + merges
+        self.reachability.add(mark, parents)
+        self.stats.count("revs")
+        self.stats.tick()
         return mark
     
+    def _changed(self, prefix, file, rev, entry, hidden=False):
+        """Updates a file, keeping the history of copy sources
+        
+        The blob marks of copy sources are pinned, so that they remain
+        valid when later revisions of the file are exported. A hidden
+        file is outside the path filter, and only its history is kept."""
+        
+        if not hidden:
+            self.output[file] = entry
+        source = prefix[1:] + file
+        if self._copy_source(source):
+            self.history.set(source, rev, entry)
+            self.output.pinned.add(entry[0])
+    
+    def _deleted(self, prefix, file, rev):
+        self._forget(prefix[1:] + file, rev)
+        self.output.delete(file)
+    
+    def _forget(self, path, rev):
+        """Records the deletion of any copy sources in a subtree"""
+        for [name, _] in list(self.history.walk(path, rev)):
+            self.history.set("/".join(filter(None, (path, name))), rev, None)
+    
+    def _history_complete(self, path, rev):
+        """Whether all files of a copy source are in the history
+        
+        This is only so if every revision of the source was read, so not
+        for paths outside the exported branches, nor for revisions of a
+        branch that were already exported, such as from the revision
+        map."""
+        
+        path = f"/{path}/"
+        return any(path.startswith(prefix) and start <= rev
+            for [prefix, start] in self.history_starts.items())
+    
+    def _wanted(self, path, prefix):
+        """Whether the content of a node in the branch is needed
+        
+        Directories are kept if anything under them is selected, or if
+        they are copied, because a copy may bring selected files or copy
+        sources with it. Files outside the filter are still kept if they
+        are later copied."""
+        
+        file = path[len(prefix):]
+        if self._header.get("Node-kind") == "dir":
+            return self.filter.touches(file) \
+                or "Node-copyfrom-path" in self._header
+        return self.filter.selected(file) or self._copy_source(path[1:])
+    
+    def _copy_source(self, path):
+        if "" in self.copy_sources:
+            return True
+        end = 0
+        while end >= 0:
+            end = path.find("/", end + 1)
+            if path[:end if end >= 0 else None] in self.copy_sources:
+                return True
+        return False
+    
+    def merge_heads(self, mergeinfo, basehist, gitrev):
+        """Exports merge sources and returns only the independent heads
+        
+        Sources in the natural history of the base or of another source
+        are dropped before anything is exported for them, and the
+        exported commits are then pruned using the reachability index."""
+        
+        sources = list()
+        histories = list()
+        for (branch, ranges) in mergeinfo.branches.items():
+            for (_, end) in ranges:
+                if end in basehist.branches.get(branch, ()):
+                    continue
+                history = Ancestors(self)
+                history.add_natural(branch, end)
+                sources.append((branch, end))
+                histories.append(history)
+        
+        merges = list()
+        for (i, (branch, end)) in enumerate(sources):
+            if any(i != j and end in history.branches.get(branch, ())
+                    for (j, history) in enumerate(histories)):
+                continue
+            ancestor = self.export(self.git_ref, branch.lstrip("/"), end)
+            if ancestor is not None:
+                merges.append(ancestor)
+        return self.reachability.independent(merges, base=gitrev)
+    
+    @contextmanager
+    def profiling(self, rev):
+        if self.profile_revs is None:
+            yield
+            return
+        (start, end) = self.profile_revs
+        if not start <= rev <= end:
+            yield
+            return
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+    
+    def _read_record(self):
+        header = self._read_header()
+        return (header, self._read_content(header))
+    
+    def _read_header(self):
+        with self.stats.timer("header parse"):
+            header = read_header(self.dump)
+        self.stats.count("records")
+        return header
+    
+    def _read_content(self, header):
+        with self.stats.timer("dump read"):
+            content = read_content(self.dump, header)
+        if content is not None:
+            self.stats.count("dump bytes", len(content))
+        return content
+    
+    def _streamed_length(self, header):
+        """Returns the text length if it should not be held in memory"""
+        if self.memory_budget is None or header.get("Node-kind") != "file" \
+                or header.get("Text-delta") == "true":
+            return None
+        length = header.get("Text-content-length")
+        if length is None or int(length) <= self.memory_budget:
+            return None
+        return int(length)
+    
+    def _skip_content(self, header):
+        with self.stats.timer("dump skip"):
+            length = skip_content(self.dump, header)
+        self.stats.count("skipped bytes", length)
+    
     def log(self, message):
         if not self.quiet:
             stderr.write(message)
             stderr.flush()
 
+class Reachability:
+    """Ancestry index of the commits exported so far
+    
+    Each commit records its parents and a generation number, one more
+    than its highest parent. A reachability query walks the parents,
+    but not down to generations at or below the one looked for, so the
+    walk is bounded by the generation difference, and the index only
+    grows linearly. Commits that were not exported by this process,
+    such as from the revision map, are treated as roots."""
+    
+    def __init__(self):
+        self.parents = dict()
+        self.generations = dict()
+    
+    def add(self, commit, parents):
+        generation = 0
+        for parent in parents:
+            if parent not in self.generations:
+                self.parents[parent] = ()
+                self.generations[parent] = 0
+            generation = max(generation, self.generations[parent] + 1)
+        self.parents[commit] = tuple(parents)
+        self.generations[commit] = generation
+    
+    def is_ancestor(self, ancestor, commit):
+        """Whether "ancestor" is reachable from, or is, "commit"."""
+        if ancestor == commit:
+            return True
+        generation = self.generations.get(ancestor)
+        if generation is None or commit not in self.generations:
+            return False
+        pending = [commit]
+        visited = {commit}
+        while pending:
+            for parent in self.parents[pending.pop()]:
+                if parent == ancestor:
+                    return True
+                if parent in visited \
+                        or self.generations[parent] <= generation:
+                    continue
+                visited.add(parent)
+                pending.append(parent)
+        return False
+    
+    def independent(self, heads, base=None):
+        """Drops heads reachable from the base or another head"""
+        result = list()
+        for (i, head) in enumerate(heads):
+            if head in heads[:i]:
+                continue
+            if base is not None and self.is_ancestor(head, base):
+                continue
+            if any(j != i and other != head
+                    and self.is_ancestor(head, other)
+                    for (j, other) in enumerate(heads)):
+                continue
+            result.append(head)
+        return result
+
 class PendingSegments:
     def __init__(self, exporter, branch, rev=None):
         # List of (base, end, path), from youngest to oldest segment.
@@ -441,16 +831,12 @@ class PendingSegments:
         self.segments = list()
         
         self.base = (0, "")  # Default if no revisions are already exported
-        segments = iter_location_segments(exporter, branch, rev)
+        segments = exporter.locations.get(exporter, branch, rev)
         for [start, end, path] in segments:
-            (kstarts, runs) = exporter.known_branches.get(path, ((), ()))
-            i = bisect_right(kstarts, end)
-            # Only kstarts[:i] are all <= end. If it exists, kstart[i] > end.
-            
-            if i:
-                # Already imported segment at index i - 1 might overlap
-                run = runs[i - 1]
-                base = kstarts[i - 1] + len(run) - 1  # Last imported revision
+            # Youngest already imported revision no younger than the segment
+            known = exporter.known_branches.floor(path, end)
+            if known is not None:
+                (base, git_base) = known
                 if base >= start:
                     # Not all revisions in segment are younger than base revision
                     
@@ -460,7 +846,7 @@ class PendingSegments:
                     # else: No part of segment is younger
                     
                     self.base = (base, path)
-                    self.git_base = run[-1]
+                    self.git_base = git_base
                     return
                 # else: Entire segment is younger: import all revisions
             # else: Nothing imported yet
@@ -475,6 +861,73 @@ class PendingSegments:
             (base, end, path) in self)
         return "<{} {}>".format(type(self).__name__, ", ".join(segs))
 
+def dump_log(dump):
+    """Builds the equivalent of "svn log --xml -v" from a dump
+    
+    Only the revision properties are read; node content is skipped.
+    The entries are ordered youngest first, like the "svn log" default."""
+    
+    entries = list()
+    paths = None
+    actions = {"add": "A", "change": "M", "delete": "D", "replace": "R"}
+    while True:
+        try:
+            header = read_header(dump)
+        except EOFError:
+            break
+        path = header.get("Node-path")
+        if path is not None:
+            skip_content(dump, header)
+            if paths is None:
+                continue  # Revision 0 is not logged
+            path = "/" + path
+            action = actions[header["Node-action"]]
+            previous = paths.get(path)
+            if previous is not None:
+                # Older dumps write a replacement as a delete then add
+                assert previous.get("action") == "D"
+                assert action == "A"
+                action = "R"
+            else:
+                previous = ElementTree.SubElement(paths_element, "path")
+                paths[path] = previous
+            previous.set("action", action)
+            kind = header.get("Node-kind")
+            if kind is not None:
+                previous.set("kind", kind)
+            from_path = header.get("Node-copyfrom-path")
+            if from_path is not None:
+                previous.set("copyfrom-path", "/" + from_path.lstrip("/"))
+                previous.set("copyfrom-rev", header["Node-copyfrom-rev"])
+            previous.text = path
+            continue
+        
+        rev = header.get("Revision-number")
+        content = read_content(dump, header)
+        if rev is None:
+            continue  # Format version or UUID record
+        if rev == "0":
+            paths = None
+            continue
+        [props, _] = parse_content(header, content)
+        entry = ElementTree.Element("logentry", revision=rev)
+        author = props.get(b"svn:author")
+        if author is not None:
+            ElementTree.SubElement(entry, "author").text = author
+        date = props.get(b"svn:date")
+        if date is not None:
+            ElementTree.SubElement(entry, "date").text = date
+        paths_element = ElementTree.SubElement(entry, "paths")
+        paths = dict()
+        entries.append(entry)
+    
+    log = ElementTree.Element("log")
+    for entry in reversed(entries):
+        if not len(entry.find("paths")):
+            entry.remove(entry.find("paths"))
+        log.append(entry)
+    return log
+
 def iter_revs(*pos, **kw):
     return closing(iter(ExportRevs(*pos, **kw)))
 
@@ -519,40 +972,125 @@ def ExportRevs(exporter, path, base, end):
                     p.get("copyfrom-path"), p.get("copyfrom-rev"))
             yield (rev, entry.find("date").text, author, path_map)
 
+class RangeSet:
+    """Set of revision numbers, held as sorted and coalesced ranges
+    
+    The inclusive start and end revisions of the ranges are kept in two
+    parallel lists, so that a range is located by bisection, adjacent
+    and overlapping ranges are merged by a single slice assignment, and
+    whole sets are compared by list comparison."""
+    
+    def __init__(self, ranges=()):
+        self.starts = list()
+        self.ends = list()
+        for (start, end) in ranges:
+            self.add(start, end)
+    
+    def add(self, start, end):
+        # Ranges [i, j) overlap or adjoin the new range
+        i = bisect_left(self.ends, start - 1)
+        j = bisect_right(self.starts, end + 1, i)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = (start,)
+        self.ends[i:j] = (end,)
+    
+    def covers(self, start, end):
+        i = bisect_right(self.starts, start)
+        return i > 0 and self.ends[i - 1] >= end
+    
+    def __contains__(self, rev):
+        return self.covers(rev, rev)
+    
+    def __le__(self, other):
+        return all(map(other.covers, self.starts, self.ends))
+    
+    def __eq__(self, other):
+        return self.starts == other.starts and self.ends == other.ends
+    
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def copy(self):
+        copy = RangeSet()
+        copy.starts = list(self.starts)
+        copy.ends = list(self.ends)
+        return copy
+    
+    def __str__(self):
+        return ",".join(format(start) if start == end else f"{start}-{end}"
+            for (start, end) in self)
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
 class RevisionSet:
     def __init__(self):
-        self.branches = defaultdict(list)
+        self.branches = defaultdict(RangeSet)
     
     def update(self, other):
         for (branch, ranges) in other.branches.items():
-            self.branches[branch] = list(ranges)
+            self.branches[branch] = ranges.copy()
+    
+    def union(self, other):
+        for (branch, start, end) in other:
+            self.add_segment(branch, start, end)
     
     def add_segment(self, branch, start, end):
-        ranges = self.branches[branch]
-        i = bisect_left(ranges, (start, 0, True))
-        
-        starti = i
-        if i > 0:
-            (rstart, rend, _) = ranges[i - 1]
-            if rend + 1 >= start:
-                start = rstart
-                end = max(end, rend)
-                starti = i - 1
-        
-        stopi = i
-        if i < len(ranges):
-            (rstart, rend, _) = ranges[i]
-            if rstart <= end + 1:
-                end = max(end, rend)
-                stopi = i + 1
-        
-        ranges[starti:stopi] = ((start, end, True),)
+        self.branches[branch].add(start, end)
+    
+    def __iter__(self):
+        for (branch, ranges) in self.branches.items():
+            for (start, end) in ranges:
+                yield (branch, start, end)
+    
+    def __bool__(self):
+        return any(self.branches.values())
+    
+    def __le__(self, other):
+        for (branch, ranges) in self.branches.items():
+            if ranges and not ranges <= other.branches.get(branch,
+                    RangeSet()):
+                return False
+        return True
     
     def __eq__(self, other):
-        return self.branches == other.branches
+        return self._nonempty() == other._nonempty()
+    
+    def _nonempty(self):
+        return {branch: ranges
+            for (branch, ranges) in self.branches.items() if ranges}
     
     def __repr__(self):
-        return generate_mergeinfo_property(self.branches)
+        return generate_mergeinfo_property(self)
+
+def parse_mergeinfo_property(value):
+    """Parses the inheritable ranges of an "svn:mergeinfo" value"""
+    mergeinfo = RevisionSet()
+    for line in value.splitlines():
+        if not line:
+            continue
+        [path, ranges] = line.rsplit(":", 1)
+        for range in ranges.split(","):
+            if range.endswith("*"):
+                continue  # Non-inheritable
+            [start, _, end] = range.partition("-")
+            start = int(start)
+            if end:
+                end = int(end)
+            else:
+                end = start
+            mergeinfo.add_segment(path, start, end)
+    return mergeinfo
+
+def generate_mergeinfo_property(mergeinfo):
+    return "\n".join(f"{branch}:{ranges}"
+        for (branch, ranges) in sorted(mergeinfo.branches.items())
+        if ranges)
 
 class Ancestors(RevisionSet):
     def __init__(self, exporter):
@@ -561,21 +1099,58 @@ class Ancestors(RevisionSet):
     
     def add_natural(self, branch, rev):
         branch = branch.lstrip("/")
-        # TODO: global cache
         get_location_segments(self.exporter, self.on_segment, branch, rev)
     
     def on_segment(self, start, end, path):
-        path = "/" + path
-        ranges = self.branches[path]
-        i = bisect_left(ranges, (start, 0, True))
-        # If it exists, ranges[i] is the first >= start
-        if i < len(ranges):
-            (rstart, rend, inheritable) = ranges[i]
-            if rstart == start:
-                ranges[i] = (rstart, max(rend, end), inheritable)
-                raise StopIteration()
-        
-        ranges.insert(i, (start, end, True))
+        ranges = self.branches["/" + path]
+        # Older segments are already known if this one overlaps
+        known = start in ranges
+        ranges.add(start, end)
+        if known:
+            raise StopIteration()
+
+def get_location_segments(exporter, callback, path="", rev=None):
+    """Calls callback(start, end, path) for each segment, youngest first
+    
+    The callback may raise StopIteration to skip the remaining older
+    segments."""
+    segments = exporter.locations.get(exporter, path, rev)
+    for [start, end, segment_path] in segments:
+        try:
+            callback(start, end, segment_path)
+        except StopIteration:
+            break
+
+class LocationCache:
+    """Memoizes the location segments of an exporter's log
+    
+    Entries are keyed by path and peg revision, so that repeatedly
+    merging from the same branch does not search the log again. The
+    least recently used entries are evicted once there are more than
+    "size" of them."""
+    
+    def __init__(self, size=10000):
+        self.size = size
+        self.entries = OrderedDict()
+    
+    def get(self, exporter, path="", rev=None):
+        if rev is None:
+            # The youngest revision depends on the log being exported
+            return tuple(iter_location_segments(exporter, path, rev))
+        key = (path, rev)
+        try:
+            segments = self.entries[key]
+        except LookupError:
+            segments = tuple(iter_location_segments(exporter, path, rev))
+            self.entries[key] = segments
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return segments
+    
+    def clear(self):
+        self.entries.clear()
 
 def iter_location_segments(exporter, path="", rev=None):
     loc = f"/{path}"
@@ -611,10 +1186,15 @@ def iter_location_segments(exporter, path="", rev=None):
         yield (entry_rev, rev, path)
 
 class FastExport(Context):
-    def __init__(self, *pos, **kw):
+    def __init__(self, *pos, stats=None, **kw):
         try:
+            if stats is None:
+                stats = Stats(timing=False)
+            self.stats = stats
             self.nextmark = 1
-            self.files = dict()
+            self.files = FileTree()
+            self.base = None
+            self.pinned = set()
             self.open(*pos, **kw)
         except:
             self.__exit__(*exc_info())
@@ -629,59 +1209,248 @@ class FastExport(Context):
     
     def printf(self, format, *pos, **kw):
         line = format.format(*pos, **kw).encode("utf-8")
-        self.file.writelines((line, b"\n"))
+        self.write(line, b"\n")
+    
+    def write(self, *data):
+        with self.stats.timer("output"):
+            self.file.writelines(data)
+        self.stats.count("output bytes", sum(map(len, data)))
+    
+    def copy(self, stream, size, bufsize=0x100000):
+        with self.stats.timer("output"):
+            copy_stream(stream, self.file, size, bufsize)
+        self.stats.count("output bytes", size)
     
     def blob(self, path, buf):
-        blob = self.blob_header(path, buf)
-        self.file.write(buf)
+        blob = self.blob_header(path, len(buf))
+        self.write(buf)
+        self.printf("")
+        return blob
+    
+    def blob_copy(self, path, stream, size, bufsize=0x100000):
+        """Writes a blob copied from the current position of a stream"""
+        blob = self.blob_header(path, size)
+        self.copy(stream, size, bufsize)
         self.printf("")
         return blob
     
-    def blob_header(self, path, buf):
-        (mark, _) = self.files.get(path, (None, None))
-        if mark is None:
+    def blob_header(self, path, size):
+        """Starts a blob, reusing the mark of the file at "path"
+        
+        If "path" is None, a new mark is used, and the blob is not
+        entered in the file table."""
+        
+        if path is None:
+            file = None
+        else:
+            file = self.files.get(path)
+        # Only reuse marks, not the hashes of blobs in a base commit
+        if file is None or isinstance(file, dict) \
+                or not file[0].startswith(":") or file[0] in self.pinned:
             mark = self.newmark()
-            self.files[path] = (mark,)
+            if path is not None:
+                self.files[path] = (mark,)
+        else:
+            mark = file[0]
         
         self.printf("blob")
         self.printf("mark {}", mark)
-        self.printf("data {}", len(buf))
+        self.printf("data {}", size)
         return mark
     
+    def checkpoint(self):
+        self.printf("checkpoint")
+        self.printf("")
+        self.stats.count("checkpoints")
+    
+    def reset(self, base):
+        """Clears the file table, so that files are looked up in a base
+        commit instead"""
+        self.files = FileTree()
+        self.base = base
+    
+    def ls(self, commit, path):
+        """Returns the (blob, mode) entry of a file in a commit, or None"""
+        return None
+    
     def __setitem__(self, path, value):
         self.files[path] = value
     def __getitem__(self, path):
-        return self.files[path]
+        entry = self.files.get(path)
+        if entry is None and self.base is not None:
+            entry = self.ls(self.base, path)
+            if entry is not None:
+                self.files[path] = entry
+        if entry is None or isinstance(entry, dict):
+            raise KeyError(path)
+        return entry
+    
+    def delete(self, path):
+        return self.files.delete(path)
+
+class FileTree:
+    """Tree of exported files, indexed by relative path
+    
+    Each directory is a dictionary mapping names to either subdirectories
+    or file entries, so deleting or replacing a directory only touches
+    its parent, and walking a subtree only visits that subtree."""
+    
+    def __init__(self):
+        self.root = dict()
+    
+    def get(self, path, default=None):
+        entry = self.root
+        for name in path.split("/"):
+            if not isinstance(entry, dict):
+                return default
+            entry = entry.get(name)
+            if entry is None:
+                return default
+        return entry
+    
+    def __getitem__(self, path):
+        entry = self.get(path)
+        if entry is None:
+            raise KeyError(path)
+        return entry
+    
+    def __contains__(self, path):
+        return self.get(path) is not None
+    
+    def __setitem__(self, path, value):
+        [*dirs, name] = path.split("/")
+        parent = self.root
+        for dir in dirs:
+            entry = parent.get(dir)
+            if not isinstance(entry, dict):
+                entry = dict()
+                parent[dir] = entry
+            parent = entry
+        parent[name] = value
+    
+    def delete(self, path):
+        """Removes a file or a whole subtree and returns it
+        
+        Returns None if nothing exists at the path. Directories left
+        empty are pruned, since Git does not track them."""
+        
+        parents = list()
+        entry = self.root
+        for name in path.split("/"):
+            if not isinstance(entry, dict) or name not in entry:
+                return None
+            parents.append((entry, name))
+            entry = entry[name]
+        for (parent, name) in reversed(parents):
+            del parent[name]
+            if parent or parent is self.root:
+                break
+        return entry
+    
+    def walk(self, path=""):
+        """Yields (relative path, entry) for each file in a subtree"""
+        if path:
+            entry = self.get(path)
+        else:
+            entry = self.root
+        if entry is None:
+            return
+        if not isinstance(entry, dict):
+            yield ("", entry)
+            return
+        stack = [("", entry)]
+        while stack:
+            [prefix, dir] = stack.pop()
+            for (name, entry) in dir.items():
+                if isinstance(entry, dict):
+                    stack.append((prefix + name + "/", entry))
+                else:
+                    yield (prefix + name, entry)
+
+class FileHistory:
+    """Exported file entries of absolute paths, by Subversion revision
+    
+    A deleted file is recorded with the entry None."""
+    
+    def __init__(self):
+        self.files = FileTree()
+    
+    def set(self, path, rev, entry):
+        history = self.files.get(path)
+        if history is None or isinstance(history, dict):
+            history = (list(), list())
+            self.files[path] = history
+        [revs, entries] = history
+        if revs and revs[-1] == rev:
+            entries[-1] = entry
+        else:
+            assert not revs or revs[-1] < rev
+            revs.append(rev)
+            entries.append(entry)
+    
+    def get(self, path, rev):
+        history = self.files.get(path)
+        if history is None or isinstance(history, dict):
+            return None
+        return self._floor(history, rev)
+    
+    def walk(self, path, rev):
+        """Yields (relative path, entry) for files existing at a revision"""
+        for [name, history] in self.files.walk(path):
+            entry = self._floor(history, rev)
+            if entry is not None:
+                yield (name, entry)
+    
+    def _floor(self, history, rev):
+        [revs, entries] = history
+        i = bisect_right(revs, rev)
+        if not i:
+            return None
+        return entries[i - 1]
 
 class FastExportFile(FastExport):
-    def __init__(self, file):
+    def __init__(self, file, stats=None):
         self.filedata = dict()
         self.file = open(file, "w+b")
-        FastExport.__init__(self)
+        FastExport.__init__(self, stats=stats)
     def close(self):
         return self.file.close()
     
     def blob(self, path, buf):
         self.file.seek(0, SEEK_END)
-        blob = self.blob_header(path, buf)
+        blob = self.blob_header(path, len(buf))
         filedata = FileArray(self.file, self.file.tell(), len(buf))
         self.filedata[blob] = filedata
-        self.file.write(buf)
+        self.write(buf)
+        self.printf("")
+        return blob
+    
+    def blob_copy(self, path, stream, size, bufsize=0x100000):
+        self.file.seek(0, SEEK_END)
+        blob = self.blob_header(path, size)
+        self.filedata[blob] = FileArray(self.file, self.file.tell(), size)
+        self.copy(stream, size, bufsize)
         self.printf("")
         return blob
     
     def cat_blob(self, blob):
-        return self.filedata[blob]
+        filedata = self.filedata[blob]
+        self.file.seek(filedata.pos)
+        data = self.file.read(filedata.len)
+        self.file.seek(0, SEEK_END)
+        return data
 
 class FastExportPipe(FastExport):
-    def __init__(self, importer):
+    def __init__(self, importer, stats=None):
         self.proc = Popen(importer,
             stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=-1)
-        FastExport.__init__(self)
+        FastExport.__init__(self, stats=stats)
     def open(self):
         self.file = self.proc.stdin
         self.printf("feature done")
         self.printf("feature cat-blob")
+        self.printf("feature get-mark")
+        self.printf("feature ls")
     
     def __exit__(self, type, value, traceback):
         try:
@@ -716,39 +1485,157 @@ class FastExportPipe(FastExport):
         data = self.proc.stdout.read(size)
         self.proc.stdout.readline()
         return data
+    
+    def get_mark(self, mark):
+        self.printf("get-mark {}", mark)
+        self.file.flush()
+        return self.proc.stdout.readline().rstrip(b"\n").decode("ascii")
+    
+    def ls(self, commit, path):
+        self.printf("ls {} {}", commit, path)
+        self.file.flush()
+        line = self.proc.stdout.readline().rstrip(b"\n").decode("utf-8")
+        if line.startswith("missing "):
+            return None
+        [mode, type, blob] = line.split("\t", 1)[0].split(" ")
+        mode = {"100644": "644", "100755": "755"}.get(mode)
+        if type != "blob" or mode is None:
+            return None
+        return (blob, mode)
+
+class Stats:
+    """Counters and cumulative timers for the phases of a conversion
+    
+    If an interval is given, tick() writes a "stats:" line with a JSON
+    object at most once per interval. Without "timing", the timers do
+    nothing, but the counters are still kept."""
+    
+    def __init__(self, interval=None, file=None, timing=True):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.start = perf_counter()
+        self.interval = interval
+        if interval is not None:
+            self.next_report = self.start + interval
+        self.file = file
+        self.timing = timing
+    
+    def timer(self, phase):
+        if not self.timing:
+            return _NO_TIMER
+        return self._timer(phase)
+    
+    @contextmanager
+    def _timer(self, phase):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += perf_counter() - start
+    
+    def count(self, name, n=1):
+        self.counts[name] += n
+    
+    def tick(self):
+        if self.interval is None:
+            return
+        now = perf_counter()
+        if now < self.next_report:
+            return
+        self.next_report = now + self.interval
+        file = self.file or stderr
+        print("stats:", json.dumps(self.snapshot(now)), file=file)
+        file.flush()
+    
+    def snapshot(self, now=None):
+        if now is None:
+            now = perf_counter()
+        elapsed = now - self.start
+        rate = 1 / elapsed if elapsed else 0
+        return {
+            "elapsed": round(elapsed, 3),
+            "revs/s": round(self.counts["revs"] * rate, 3),
+            "dump MB/s": round(self.counts["dump bytes"] * rate / 1e6, 3),
+            "output MB/s":
+                round(self.counts["output bytes"] * rate / 1e6, 3),
+            "seconds": {phase: round(seconds, 3)
+                for (phase, seconds) in self.seconds.items()},
+            "counts": dict(self.counts),
+        }
+    
+    def summary(self, file=None):
+        file = file or stderr
+        snapshot = self.snapshot()
+        print(f"{snapshot['elapsed']:.1f} s elapsed, "
+            f"{snapshot['revs/s']:.1f} revs/s, "
+            f"{snapshot['dump MB/s']:.2f} MB/s dump read, "
+            f"{snapshot['output MB/s']:.2f} MB/s output", file=file)
+        for (phase, seconds) in sorted(self.seconds.items(),
+                key=lambda item: item[1], reverse=True):
+            print(f"  {phase}: {seconds:.3f} s", file=file)
+        for (name, count) in sorted(self.counts.items()):
+            print(f"  {name}: {count}", file=file)
+
+_NO_TIMER = nullcontext()
+
+class NodeProgress:
+    """Counts the nodes of each revision, redrawn at a limited rate
+    
+    The counts are rewritten in place on the current progress line, at
+    most once per "period" seconds, rather than listing every node on
+    the terminal. Each node is listed in the verbose log file, if given."""
+    
+    def __init__(self, file, verbose=None, period=0.2):
+        self.file = file
+        self.verbose = verbose
+        self.period = period
+        self.rev = None
+        self.counts = dict()
+        self.shown = ""
+        self.next_render = monotonic()
+    
+    def revision(self, rev):
+        self.rev = rev
+        self.counts.clear()
+        self.shown = ""
+    
+    def node(self, action, path):
+        self.counts[action] = self.counts.get(action, 0) + 1
+        if self.verbose is not None:
+            self.verbose.write(f"r{self.rev} {action} {path}\n")
+        if self.file is not None and monotonic() >= self.next_render:
+            self.render()
+    
+    def finish(self):
+        if self.file is not None and self.counts:
+            self.render()
+        self.counts.clear()
+        self.shown = ""
+    
+    def render(self):
+        counts = ", ".join(f"{count} {action}"
+            for (action, count) in sorted(self.counts.items()))
+        text = f" {counts}"
+        padding = max(len(self.shown) - len(text), 0)
+        self.file.writelines(("\b" * len(self.shown), text,
+            " " * padding, "\b" * padding))
+        self.file.flush()
+        self.shown = text
+        self.next_render = monotonic() + self.period
 
 class DirEditor:
     def open_directory(self, path, base):
-        if not self.rev.quiet:
-            stderr.writelines(("\n  M ", path, "/"))
-            stderr.flush()
+        self.rev.nodes.node("M", path + "/")
         return self
     
     def delete_entry(self, path, rev=None):
-        if not self.rev.quiet:
-            stderr.writelines(("\n  D ", path))
-            stderr.flush()
+        self.rev.nodes.node("D", path)
         self.rev.edits.append("D {}".format(path))
 
 class RootEditor(DirEditor):
     def change_prop(self, name, value):
         if name == PROP_MERGEINFO:
-            for (path, ranges) in parse_mergeinfo_property(value).items():
-                inhranges = list()
-                for range in ranges:
-                    (_, _, inheritable) = range
-                    if inheritable:
-                        inhranges.append(range)
-                if inhranges:
-                    self.rev.mergeinfo[path] = inhranges
-
-def read_int(stream):
-    i = 0
-    while True:
-        [byte] = stream.read(1)
-        i = i << 7 | byte & 0x7F
-        if not byte & 0x80:
-            return i
+            self.rev.mergeinfo.union(parse_mergeinfo_property(value))
 
 class FileArray(object):
     def __init__(self, file, pos, len):
@@ -768,39 +1655,6 @@ class FileArray(object):
         return "{}({}, {}, {})".format(type(self).__name__,
             self.file, self.pos, self.len)
 
-def parse_content(header, content):
-    props = dict()
-    props_length = header.get_all("Prop-content-length")
-    if props_length:
-        [props_length] = props_length
-        props_data = BytesIO(content[:int(props_length)])
-        content = content[int(props_length):]
-        for line in iter(props_data.readline, b"PROPS-END\n"):
-            assert line.endswith(b"\n")
-            assert line.startswith(b"K ")
-            length = int(line[2:-1])
-            name = props_data.read(length)
-            assert len(name) == length
-            line = props_data.read(1)
-            assert line == b"\n"
-            line = props_data.readline()
-            assert line.endswith(b"\n")
-            assert line.startswith(b"V ")
-            length = int(line[2:-1])
-            value = props_data.read(length)
-            assert len(value) == length
-            props[name] = value.decode("ascii")
-            line = props_data.read(1)
-            assert line == b"\n"
-    length = header.get_all("Text-content-length")
-    if length is None:
-        assert not content
-        content = None
-    else:
-        [length] = length
-        assert len(content) == int(length)
-    return (props, content)
-
 @contextmanager
 def progresscontext(*args):
     stderr.writelines(args)
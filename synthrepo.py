@@ -0,0 +1,216 @@
+#! /usr/bin/env python3
+
+"""Writes synthetic Subversion dumps and logs of a chosen size
+
+Revisions are described as dictionaries, as in the test suite:
+
+* "props": revision properties (str to str)
+* "nodes": sequence of node dictionaries, with optional "action",
+    "kind", "path", "copyfrom_path" and "copyfrom_rev" items, "props"
+    (str to str), "content" (bytes), and "delta" (true if the content
+    is an "svndiff" delta against "delta_base")
+"""
+
+from email.message import Message
+from email.generator import BytesGenerator
+from io import BytesIO, TextIOWrapper
+from xml.sax import saxutils
+from hashlib import md5
+import random
+from _common import encode_svndiff
+
+UUID = "00000000-0000-0000-0000-000000000000"
+
+FILE_PROPS = {
+    "svn:eol-style": "native",
+    "svn:keywords": "Author Date Id Revision",
+}
+
+def main(*,
+    dump: dict(metavar="FILENAME", help="dump file to write"),
+    log: dict(metavar="FILENAME", help="XML log file to write") = None,
+    revisions: dict(help="number of revisions") = 100,
+    files: dict(help="files modified in each revision") = 10,
+    size: dict(help="approximate file size in bytes") = 1000,
+    deltas: dict(help="write modifications as svndiff deltas") = False,
+    branches: dict(help="number of branches copied from trunk") = 0,
+    copies: dict(help="number of file copies within trunk") = 0,
+    seed: dict(help="random number generator seed") = 0,
+):
+    """Generates a synthetic repository dump and log"""
+    revs = generate(revisions=revisions, files=files, size=size,
+        deltas=deltas, branches=branches, copies=copies, seed=seed)
+    with open(dump, "wb") as file:
+        write_dump(file, revs)
+    if log is not None:
+        with open(log, "wb") as file:
+            write_log(file, revs)
+
+def generate(*, revisions=100, files=10, size=1000, deltas=False,
+        branches=0, copies=0, seed=0):
+    """Returns a list of revisions modifying files in /trunk
+    
+    Revision 1 adds /trunk and /branches. Each following revision adds or
+    modifies the given number of files, and branch copies and file
+    copies are spread evenly over the revisions."""
+    
+    rng = random.Random(seed)
+    revs = [dict(nodes=[
+        dict(action="add", path="trunk", kind="dir"),
+        dict(action="add", path="branches", kind="dir"),
+    ])]
+    contents = dict()
+    names = list()
+    branch_revs = _spread(branches, revisions)
+    copy_revs = _spread(copies, revisions)
+    for rev in range(2, revisions + 1):
+        nodes = list()
+        for _ in range(files):
+            if names and rng.random() < 0.7:
+                name = rng.choice(names)
+                action = "change"
+            else:
+                name = f"trunk/file{len(names)}"
+                names.append(name)
+                action = "add"
+            if any(node["path"] == name for node in nodes):
+                continue
+            old = contents.get(name, b"")
+            new = _modify(rng, old, size)
+            contents[name] = new
+            node = dict(action=action, path=name, kind="file")
+            if action == "add":
+                node["props"] = dict(FILE_PROPS)
+            if deltas:
+                node.update(content=encode_svndiff(old, new), delta=True,
+                    delta_base=old, text=new)
+            else:
+                node["content"] = new
+            nodes.append(node)
+        # Copy from files that this revision does not modify
+        modified = {node["path"] for node in nodes}
+        sources = [name for name in names if name not in modified]
+        for _ in range(copy_revs.count(rev)):
+            if not sources:
+                break
+            source = rng.choice(sources)
+            name = f"trunk/copy{len(names)}"
+            names.append(name)
+            contents[name] = contents[source]
+            nodes.append(dict(action="add", path=name, kind="file",
+                copyfrom_path=source, copyfrom_rev=rev - 1))
+        for i in range(branch_revs.count(rev)):
+            nodes.append(dict(action="add",
+                path=f"branches/branch{rev}-{i}", kind="dir",
+                copyfrom_path="trunk", copyfrom_rev=rev - 1))
+        revs.append(dict(props={"svn:log": f"Revision {rev}"},
+            nodes=nodes))
+    return revs
+
+def _spread(count, revisions):
+    if revisions < 3:
+        return [2] * count
+    return [3 + i * (revisions - 2) // max(count, 1) for i in range(count)]
+
+def _modify(rng, old, size):
+    lines = old.splitlines(keepends=True)
+    line = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ")
+        for _ in range(rng.randrange(20, 80)))
+    line = f"{line}\n".encode("ascii")
+    if lines and sum(map(len, lines)) >= size:
+        lines[rng.randrange(len(lines))] = line
+    else:
+        lines.insert(rng.randrange(len(lines) + 1), line)
+    return b"".join(lines)
+
+def write_dump(file, revs):
+    dump_message(file, (("SVN-fs-dump-format-version", "3"
+        if any(node.get("delta") for rev in revs
+        for node in rev.get("nodes", ())) else "2"),))
+    dump_message(file, (("UUID", UUID),))
+    
+    for (i, rev) in enumerate(revs, 1):
+        props = {
+            "svn:date": "1970-01-01T00:00:00.000000Z",
+            "svn:log": "",
+        }
+        props.update(rev.setdefault("props", dict()))
+        headers = (("Revision-number", format(i)),)
+        dump_message(file, headers, props=props)
+        
+        for node in rev.setdefault("nodes", {}):
+            headers = list()
+            for name in (
+                "action", "kind", "path",
+                "copyfrom-path", "copyfrom-rev",
+            ):
+                value = node.get(name.replace("-", "_"))
+                if value is not None:
+                    headers.append(("Node-" + name, format(value)))
+            if node.get("delta"):
+                headers.append(("Text-delta", "true"))
+                if node["delta_base"]:
+                    headers.append(("Text-delta-base-md5",
+                        md5(node["delta_base"]).hexdigest()))
+                headers.append(("Text-content-md5",
+                    md5(node["text"]).hexdigest()))
+            dump_message(file, headers,
+                props=node.get("props"), content=node.get("content"))
+
+def write_log(file, revs):
+    log = TextIOWrapper(file, "utf-8")
+    log.write("<log>")
+    for [i, rev] in enumerate(reversed(revs)):
+        i = format(len(revs) - i)
+        log.write(f"<logentry revision={saxutils.quoteattr(i)}>")
+        author = rev.get("props", {}).get("svn:author")
+        if author is not None:
+            log.write(f"<author>{saxutils.escape(author)}</author>")
+        log.write("<date>1970-01-01T00:00:00.000000Z</date><paths>")
+        for node in rev.get("nodes", ()):
+            action = {"add": "A", "change": "M", "delete": "D",
+                "replace": "R"}[node['action']]
+            attrs = f"action={saxutils.quoteattr(action)}"
+            if node.get("copyfrom_path") is not None:
+                copyfrom = "/" + node["copyfrom_path"]
+                attrs += f" copyfrom-path={saxutils.quoteattr(copyfrom)}"
+                copyfrom = format(node["copyfrom_rev"])
+                attrs += f" copyfrom-rev={saxutils.quoteattr(copyfrom)}"
+            log.write(f"<path {attrs}>/{saxutils.escape(node['path'])}</path>")
+        log.write("</paths></logentry>")
+    log.write("</log>")
+    log.detach()
+
+def dump_message(file, headers, props=None, content=None):
+    msg = Message()
+    for (name, value) in headers:
+        msg[name] = value
+    payload = BytesIO()
+    
+    if props is not None:
+        start = payload.tell()
+        for (key, value) in props.items():
+            payload.write("K {}\n".format(len(key)).encode("ascii"))
+            payload.writelines((key.encode("ascii"), b"\n"))
+            payload.write("V {}\n".format(len(value)).encode("ascii"))
+            payload.writelines((value.encode("ascii"), b"\n"))
+        payload.write(b"PROPS-END\n")
+        
+        msg["Prop-content-length"] = format(payload.tell() - start)
+    
+    if content is not None:
+        msg["Text-content-length"] = format(len(content))
+        payload.write(content)
+    
+    payload = payload.getvalue()
+    if props is not None or content is not None:
+        msg["Content-length"] = format(len(payload))
+    
+    # Write the payload directly, because the generator would translate
+    # line endings in binary content such as deltas
+    BytesGenerator(file, mangle_from_=False).flatten(msg)
+    file.write(payload)
+
+if __name__ == "__main__":
+    from _common import run_cli
+    run_cli(main)
@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+
+from unittest import TestCase
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from importlib.machinery import SourceFileLoader
+from importlib.util import spec_from_loader, module_from_spec
+import os.path
+import io
+import subprocess
+
+def load_gitrip():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gitrip")
+    loader = SourceFileLoader("gitrip", path)
+    module = module_from_spec(spec_from_loader("gitrip", loader))
+    loader.exec_module(module)
+    return module
+
+gitrip = load_gitrip()
+
+# Commit graph: each commit lists its parents
+GRAPH = {
+    "d" * 40: ("b" * 40, "c" * 40),
+    "c" * 40: ("a" * 40,),
+    "b" * 40: ("a" * 40,),
+    "a" * 40: ("0" * 40,),
+}
+
+class Gitweb(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+    
+    def do_GET(self):
+        if self.path.startswith("/old/"):
+            # Relative redirection to the current location
+            self.send_response(301)
+            self.send_header("Location", self.path[len("/old"):])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        [hash] = query["h"]
+        if hash not in GRAPH:
+            self.send_error(404)
+            return
+        [action] = query["a"]
+        if action == "commit":
+            body = commit_page(hash)
+        else:
+            body = "{} {}".format(action, hash)
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+def commit_page(hash):
+    rows = ["<tr><td>commit</td><td>{}</td></tr>".format(hash)]
+    for parent in GRAPH[hash]:
+        rows.append("<tr><td>parent</td><td><a>{}</a></td></tr>".format(
+            parent))
+    rows.append("<tr><td>committer</td><td><a>Name</a><a>name@example</a>"
+        "Mon, 1 Jan 2001 00:00:00 +0000 (00:00 +0000)</td></tr>")
+    return "<table>{}</table>".format("".join(rows))
+
+class TestGitweb(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Gitweb)
+        self.server.connections = 0
+        self.server.daemon_threads = True
+        thread = Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        
+        [host, port] = self.server.server_address
+        self.url = "http://{}:{}/gitweb.cgi?p=project.git&h={}".format(
+            host, port, "d" * 40)
+        self.pool = gitrip.ConnectionPool(timeout=10)
+        self.addCleanup(self.pool.close)
+    
+    def test_keep_alive(self):
+        with redirect_stdout(io.StringIO()):
+            for hash in GRAPH:
+                query = (("a", "patch"), ("h", hash))
+                data = gitrip.gitweb_download(self.url, query, self.pool)
+                self.assertEqual(data, "patch {}".format(hash).encode())
+        self.assertEqual(self.server.connections, 1)
+    
+    def test_error(self):
+        query = (("a", "patch"), ("h", "e" * 40))
+        with self.assertRaises(HTTPError):
+            gitrip.gitweb_download(self.url, query, self.pool)
+        # The server closes the connection after an error
+        query = (("a", "patch"), ("h", "a" * 40))
+        with redirect_stdout(io.StringIO()):
+            data = gitrip.gitweb_download(self.url, query, self.pool)
+        self.assertEqual(data, "patch {}".format("a" * 40).encode())
+    
+    def test_redirect(self):
+        url = self.url.replace("/gitweb.cgi", "/old/gitweb.cgi")
+        query = (("a", "patch"), ("h", "a" * 40))
+        with redirect_stdout(io.StringIO()):
+            data = gitrip.gitweb_download(url, query, self.pool)
+        self.assertEqual(data, "patch {}".format("a" * 40).encode())
+        self.assertEqual(self.server.connections, 1)
+        
+        self.pool.max_redirects = 0
+        with self.assertRaises(HTTPError) as context:
+            gitrip.gitweb_download(url, query, self.pool)
+        self.assertEqual(context.exception.code, 301)
+    
+    def test_crawl(self):
+        heads = ["d" * 40]
+        have = {"0" * 40}
+        with redirect_stdout(io.StringIO()), ThreadPoolExecutor(4) as executor:
+            commits = gitrip.crawl(self.url, heads, have.intersection,
+                executor, self.pool)
+        self.assertEqual(commits.keys(), GRAPH.keys())
+        self.assertEqual(commits["d" * 40]["patch"],
+            "commitdiff_plain {}".format("d" * 40).encode())
+        self.assertEqual(commits["a" * 40]["patch"],
+            "patch {}".format("a" * 40).encode())
+        self.assertEqual(commits["b" * 40]["date"], "978307200 +0000")
+        
+        order = gitrip.commit_order(heads, commits)
+        self.assertEqual([commit["hash"] for commit in order],
+            ["a" * 40, "b" * 40, "c" * 40, "d" * 40])
+
+class TestCommitChecker(TestCase):
+    def test_find(self):
+        tempdir = TemporaryDirectory(prefix="gitrip-")
+        self.addCleanup(tempdir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tempdir.name)
+        subprocess.check_call(("git", "init", "-q"))
+        command = ("git", "-c", "user.name=Name",
+            "-c", "user.email=name@example",
+            "commit", "-q", "--allow-empty", "-m", "Commit")
+        subprocess.check_call(command)
+        commit = subprocess.check_output(("git", "rev-parse", "HEAD"))
+        commit = commit.strip().decode("ascii")
+        tree = subprocess.check_output(("git", "rev-parse", "HEAD^{tree}"))
+        tree = tree.strip().decode("ascii")
+        
+        with gitrip.CommitChecker() as checker:
+            hashes = (commit, "0" * 40, tree)
+            self.assertEqual(checker.find(hashes), {commit})
+            self.assertEqual(checker.find(()), set())
+            self.assertEqual(checker.find(("0" * 40, commit)), {commit})
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
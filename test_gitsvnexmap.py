@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+import os.path
+import io
+import subprocess
+from unittest.mock import patch
+import gitsvnexmap
+
+ROOT = "https://svn.example/repo"
+UUID = "00000000-0000-0000-0000-000000000000"
+
+class RepoTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        tempdir = TemporaryDirectory(prefix="gitsvnexmap-")
+        self.addCleanup(tempdir.cleanup)
+        self.dir = tempdir.name
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.dir)
+        subprocess.check_call(("git", "init", "-q"))
+        self.expected = list()
+        for rev in range(1, 4):
+            self.commit(rev)
+        self.commit(None)  # Without a Subversion revision
+    
+    def commit(self, rev):
+        """Commits a revision of trunk, and returns the map line"""
+        message = "Commit"
+        if rev is not None:
+            message += f" {rev}\n\ngit-svn-id: {ROOT}/trunk@{rev} {UUID}"
+        command = ("git", "-c", "user.name=Name",
+            "-c", "user.email=name@example",
+            "commit", "-q", "--allow-empty", "-m", message)
+        subprocess.check_call(command)
+        if rev is None:
+            return None
+        commit = subprocess.check_output(("git", "rev-parse", "HEAD"))
+        line = f"/trunk@{rev} {commit.strip().decode('ascii')}"
+        self.expected.append(line)
+        return line
+    
+    def run_main(self, *roots, **kw):
+        """Returns the lines written to stdout"""
+        with redirect_stdout(io.StringIO()) as stdout:
+            gitsvnexmap.main(*roots, **kw)
+        return stdout.getvalue().splitlines()
+
+class TestScan(RepoTest):
+    def test_log(self):
+        """One "git log" splits the messages of matching commits"""
+        [tips, revs] = gitsvnexmap.scan_revs()
+        expected = list(gitsvnexmap.iter_log(revs))
+        self.assertEqual(3, len(expected))
+        for [rev, message] in expected:
+            self.assertIn(b"\ngit-svn-id: ", message)
+        # Fields split across reads
+        self.assertEqual(expected, list(gitsvnexmap.iter_log(revs, 7)))
+    
+    def test_pool(self):
+        """Parallel "git cat-file" output is in the "git log" order"""
+        [tips, revs] = gitsvnexmap.scan_revs()
+        expected = list(gitsvnexmap.iter_log(revs))
+        for jobs in (1, 2, 5):
+            self.assertEqual(expected,
+                list(gitsvnexmap.iter_catfile_pool(jobs, revs)))
+    
+    def test_main(self):
+        expected = list(reversed(self.expected))
+        self.assertEqual(expected, self.run_main(ROOT, scan=True))
+        self.assertEqual(expected, self.run_main(ROOT, scan=True, jobs=2))
+        self.assertEqual([], self.run_main(ROOT, scan=True,
+            uuid=("11111111-1111-1111-1111-111111111111",)))
+
+class TestCache(RepoTest):
+    def setUp(self):
+        RepoTest.setUp(self)
+        self.cache = os.path.join(self.dir, ".git", "svnexmap")
+    
+    def scan(self, **kw):
+        """Returns the map lines and the number of commits read"""
+        read = list()
+        iter_log = gitsvnexmap.iter_log
+        def counting(revs):
+            for item in iter_log(revs):
+                read.append(item)
+                yield item
+        with patch("gitsvnexmap.iter_log", counting):
+            lines = self.run_main(ROOT, scan=True, cache=self.cache, **kw)
+        return (lines, len(read))
+    
+    def test_incremental(self):
+        [lines, read] = self.scan()
+        self.assertEqual(3, read)
+        self.assertEqual(sorted(self.expected), sorted(lines))
+        
+        # Nothing new to read
+        self.assertEqual((lines, 0), self.scan())
+        
+        # Only the new commit is read
+        line = self.commit(4)
+        self.assertEqual((lines + [line], 1), self.scan())
+        
+        self.assertEqual(sorted(self.run_main(ROOT, scan=True)),
+            sorted(lines + [line]))
+        binary = os.path.join(self.dir, "binary")
+        self.run_main(ROOT, scan=True, binary=binary)
+        with open(binary, "rb") as file:
+            expected = file.read()
+        self.assertEqual(([], 0), self.scan(binary=binary))
+        with open(binary, "rb") as file:
+            self.assertEqual(expected, file.read())
+    
+    def test_missing_tip(self):
+        """Tips that no longer exist do not limit the scan"""
+        with open(self.cache, "wt") as file:
+            print("f" * 40, file=file)
+            print(self.expected[0], file=file)
+        [lines, read] = self.scan()
+        self.assertEqual(3, read)
+        self.assertEqual(self.expected[0], lines[0])
+        self.assertEqual(sorted(self.expected), sorted(lines))
+    
+    def test_no_scan(self):
+        with self.assertRaises(SystemExit):
+            gitsvnexmap.main(ROOT, cache=self.cache)
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
@@ -0,0 +1,258 @@
+#! /usr/bin/env python3
+
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from io import BytesIO, TextIOWrapper, StringIO
+from contextlib import redirect_stdout
+import os.path
+import json
+import svndump
+import synthrepo
+from _common import read_record, run_cli
+
+class DumpTest(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        
+        tempdir = TemporaryDirectory(prefix="svndump-")
+        self.addCleanup(tempdir.cleanup)
+        self.dir = tempdir.name
+        
+        self.revs = synthrepo.generate(revisions=10, files=3, branches=1,
+            copies=2)
+        self.dump = self.path("dump")
+        with open(self.dump, "wb") as file:
+            synthrepo.write_dump(file, self.revs)
+    
+    def path(self, name):
+        return os.path.join(self.dir, name)
+    
+    def run_main(self, *pos, **kw):
+        """Returns the standard output of svndump.main()"""
+        stdout = TextIOWrapper(BytesIO())
+        with patch("svndump.stdout", stdout):
+            svndump.main(*pos, **kw)
+        stdout.flush()
+        return stdout.buffer.getvalue()
+    
+    def assertSameDump(self, expected, actual):
+        """Compares the records, ignoring blank lines between them"""
+        self.assertEqual(read_records(expected), read_records(actual))
+
+def read_records(data):
+    """Returns the header fields and content of each record of a dump"""
+    stream = BytesIO(data)
+    records = list()
+    while True:
+        try:
+            [header, content] = read_record(stream)
+        except EOFError:
+            return records
+        records.append((header.items(), content))
+
+def text_length(records):
+    return sum(int(dict(fields).get("Text-content-length", 0))
+        for [fields, _] in records)
+
+def read_file(name):
+    with open(name, "rb") as file:
+        return file.read()
+
+class TestMerge(DumpTest):
+    def test_same(self):
+        """Nodes repeated in another dump are only written once"""
+        expected = read_file(self.dump)
+        self.assertSameDump(expected, self.run_main(self.dump))
+        self.assertSameDump(expected, self.run_main(self.dump, self.dump))
+    
+    def test_revisions(self):
+        """Dumps of separate revisions are interleaved"""
+        svndump.split_dump(BytesIO(read_file(self.dump)), self.path("{}"),
+            revs=4)
+        parts = [self.path(format(i)) for i in (2, 0, 1)]
+        self.assertSameDump(read_file(self.dump), self.run_main(*parts))
+    
+    def test_conflict(self):
+        """Different nodes at the same path are both written, with a
+        warning"""
+        self.revs[-1]["nodes"][0]["content"] += b"conflict\n"
+        other = self.path("other")
+        with open(other, "wb") as file:
+            synthrepo.write_dump(file, self.revs)
+        with self.assertWarnsRegex(UserWarning, "Conflicting node"):
+            output = self.run_main(self.dump, other)
+        records = read_records(output)
+        self.assertEqual(len(read_records(read_file(self.dump))) + 1,
+            len(records))
+    
+    def test_output(self):
+        output = self.path("output")
+        self.assertEqual(b"", self.run_main(self.dump, output=output))
+        self.assertSameDump(read_file(self.dump), read_file(output))
+
+class TestSplit(DumpTest):
+    def test_revisions(self):
+        template = self.path("part{}")
+        svndump.main(self.dump, split_revs=4, output=template)
+        revs = list()
+        for i in range(3):
+            records = read_records(read_file(template.format(i)))
+            revs.append([int(fields[0][1]) for [fields, _] in records
+                if fields[0][0] == "Revision-number"])
+        self.assertEqual([[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]], revs)
+        self.assertFalse(os.path.exists(template.format(3)))
+        
+        parts = [template.format(i) for i in range(3)]
+        self.assertSameDump(read_file(self.dump), self.run_main(*parts))
+    
+    def test_paths(self):
+        template = self.path("part{}")
+        with self.assertWarnsRegex(UserWarning, "crosses split dumps"):
+            svndump.main(self.dump, split_path=("trunk",), output=template)
+        parts = [template.format(i) for i in range(2)]
+        paths = list()
+        for part in parts:
+            records = read_records(read_file(part))
+            paths.append({dict(fields).get("Node-path")
+                for [fields, _] in records} - {None})
+        self.assertTrue(all(path.startswith("trunk") for path in paths[0]))
+        self.assertEqual({"branches", "branches/branch3-0"}, paths[1])
+        self.assertSameDump(read_file(self.dump), self.run_main(*parts))
+    
+    def test_zero(self):
+        """Fewer than one revision per dump is rejected"""
+        argv = ["svndump", "--split-revs", "0", "--output", "{}"]
+        with patch("sys.argv", argv), patch("sys.stderr", StringIO()), \
+                self.assertRaises(SystemExit) as context:
+            run_cli(svndump.main)
+        self.assertEqual(2, context.exception.code)
+
+class TestPassthrough(DumpTest):
+    def test_unseekable(self):
+        """The same output whether node content is copied or held"""
+        expected = self.run_main(self.dump)
+        stdin = TextIOWrapper(UnseekableIO(read_file(self.dump)))
+        with patch("svndump.stdin", stdin):
+            self.assertEqual(expected, self.run_main())
+    
+    def test_node(self):
+        """Node content is only held in memory if the input cannot seek"""
+        data = read_file(self.dump)
+        for stream in (BytesIO(data), UnseekableIO(data)):
+            while True:
+                [record, raw] = svndump.read_raw_header(stream)
+                if "Text-content-length" in record:
+                    break
+                svndump.read_content(stream, record)
+            start = data.index(raw) + len(raw)
+            content = data[start:start + int(record["Content-length"])]
+            
+            node = svndump.Node(stream, record, raw)
+            if stream.seekable():
+                self.assertIsNone(node.content)
+            else:
+                self.assertEqual(content, node.content)
+            output = BytesIO()
+            node.write((output,))
+            self.assertIsNone(node.content)
+            self.assertEqual(raw + content + b"\n", output.getvalue())
+            node.skip()
+            self.assertEqual(start + len(content), stream.tell())
+
+class UnseekableIO(BytesIO):
+    name = "<unseekable>"
+    
+    def seekable(self):
+        return False
+
+class TestConvert(DumpTest):
+    def test_round_trip(self):
+        """Deltifying and then undeltifying restores the full texts"""
+        deltas = BytesIO()
+        with open(self.dump, "rb") as stream:
+            svndump.convert_deltas(stream, deltas, deltify=True)
+        records = read_records(deltas.getvalue())
+        expected = read_records(read_file(self.dump))
+        self.assertTrue(any(dict(fields).get("Text-delta") == "true"
+            for [fields, _] in records))
+        self.assertLess(text_length(records), text_length(expected))
+        
+        output = BytesIO()
+        deltas.seek(0)
+        svndump.convert_deltas(deltas, output, deltify=False)
+        # Deltas need dump format version 3
+        self.assertEqual(([("SVN-fs-dump-format-version", "3")], None),
+            records[0])
+        self.assertEqual(expected[1:], read_records(output.getvalue())[1:])
+    
+    def test_unseekable(self):
+        stdin = TextIOWrapper(UnseekableIO(read_file(self.dump)))
+        with patch("svndump.stdin", stdin), \
+                self.assertRaisesRegex(SystemExit, "seekable"):
+            self.run_main(deltify=True)
+
+class TestVerify(DumpTest):
+    def verify(self, data, jobs):
+        """Returns the number of errors and the lines reported"""
+        name = self.path("verify")
+        with open(name, "wb") as file:
+            file.write(data)
+        with redirect_stdout(StringIO()) as stdout, open(name, "rb") as file:
+            errors = svndump.verify_dump(file, jobs=jobs, batch_size=1000)
+        return (errors, stdout.getvalue().splitlines())
+    
+    def test_clean(self):
+        for jobs in (1, 2):
+            self.assertEqual((0, []), self.verify(read_file(self.dump), jobs))
+        self.assertEqual(b"", self.run_main(self.dump, verify=True))
+    
+    def test_corrupt(self):
+        data = read_file(self.dump)
+        i = data.rindex(b"PROPS-END")
+        corrupt = data[:i] + b"PROPS-BAD" + data[i + 9:]
+        for jobs in (1, 2):
+            [errors, lines] = self.verify(corrupt, jobs)
+            self.assertEqual(1, errors)
+            self.assertRegex(lines[0], r": r10: Malformed property block$")
+        
+        [errors, lines] = self.verify(data[:-10], 2)
+        self.assertEqual(1, errors)
+        self.assertRegex(lines[0], r": r10 \S+: Truncated content$")
+        
+        with open(self.path("corrupt"), "wb") as file:
+            file.write(corrupt)
+        with redirect_stdout(StringIO()), \
+                self.assertRaisesRegex(SystemExit, "1 corrupt records"):
+            svndump.main(self.path("corrupt"), verify=True, jobs=1)
+
+class TestStats(DumpTest):
+    def test_report(self):
+        with open(self.dump, "rb") as file:
+            report = svndump.dump_stats(file, depth=1, rev_range=4, top=2)
+        nodes = [node for rev in self.revs for node in rev["nodes"]]
+        totals = report["totals"]
+        self.assertEqual(10, totals["revisions"])
+        self.assertEqual(len(nodes), totals["nodes"])
+        self.assertEqual(sum(len(node.get("content", b"")) for node in nodes),
+            totals["full text bytes"])
+        self.assertEqual(0, totals["delta bytes"])
+        self.assertEqual(0, totals["delta ratio"])
+        self.assertEqual(len(nodes), sum(totals["actions"].values()))
+        self.assertEqual({"trunk", "branches"}, report["prefixes"].keys())
+        self.assertEqual([(0, 3, 3), (4, 7, 4), (8, 11, 3)],
+            [(range["start"], range["end"], range["revisions"])
+            for range in report["revision ranges"]])
+        [first, second] = report["largest revisions"]
+        self.assertGreaterEqual(first["bytes"], second["bytes"])
+        
+        output = self.path("stats")
+        svndump.main(self.dump, stats=True, depth=1, rev_range=4,
+            output=output)
+        with open(output, "rt") as file:
+            report = json.load(file)
+        self.assertEqual(totals, report["totals"])
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
@@ -5,14 +5,18 @@ from tempfile import TemporaryDirectory
 import subprocess
 import os.path
 import svnex
+import revmap
+import synthrepo
+import _common
 from subprocess import Popen
-from email.message import Message
-from io import BytesIO, TextIOWrapper
-from email.generator import BytesGenerator
+from io import BytesIO, TextIOWrapper, StringIO, SEEK_CUR
 from functools import partial
 from unittest.mock import patch
 import sys
-from xml.sax import saxutils
+import zlib
+import pstats
+from random import Random
+from threading import Thread
 
 class TempDirTest(TestCase):
     def setUp(self):
@@ -25,47 +29,13 @@ class TempDirTest(TestCase):
 class RepoTests(TempDirTest):
     def make_repo(self, revs):
         dump = BytesIO()
-        dump_message(dump, (("SVN-fs-dump-format-version", "2"),))
-        dump_message(dump, (
-            ("UUID", "00000000-0000-0000-0000-000000000000"),))
-        
-        for (i, rev) in enumerate(revs, 1):
-            props = {
-                "svn:date": "1970-01-01T00:00:00.000000Z",
-                "svn:log": "",
-            }
-            props.update(rev.setdefault("props", dict()))
-            headers = (("Revision-number", format(i)),)
-            dump_message(dump, headers, props=props)
-            
-            for node in rev.setdefault("nodes", {}):
-                headers = list()
-                for name in (
-                    "action", "kind", "path",
-                    "copyfrom-path", "copyfrom-rev",
-                ):
-                    value = node.get(name.replace("-", "_"))
-                    if value is not None:
-                        headers.append(("Node-" + name, format(value)))
-                dump_message(dump, headers,
-                    props=node.get("props"), content=node.get("content"))
+        synthrepo.write_dump(dump, revs)
         dump.seek(0)
         
-        log = TextIOWrapper(BytesIO(), "ascii")
-        log.write("<log>")
-        for [i, rev] in enumerate(reversed(revs)):
-            i = format(len(revs) - i)
-            log.write(f"<logentry revision={saxutils.quoteattr(i)}>")
-            author = rev["props"].get("svn:author")
-            if author is not None:
-                log.write(f"<author>{saxutils.escape(author)}</author>")
-            log.write("<date>1970-01-01T00:00:00.000000Z</date><paths>")
-            for node in rev["nodes"]:
-                action = {"add": "A", "change": "M", "delete": "D"}[node['action']]
-                log.write(f"<path action={saxutils.quoteattr(action)}>/{saxutils.escape(node['path'])}</path>")
-            log.write("</paths></logentry>")
-        log.write("</log>")
+        log = BytesIO()
+        synthrepo.write_log(log, revs)
         log.seek(0)
+        log = TextIOWrapper(log, "utf-8")
         
         return (dump, patch("svnex.stdin", log))
     
@@ -477,6 +447,330 @@ M 644 :1 file
 """,
                 output.read())
 
+def synth_exporter(revs, output, **kw):
+    """Returns an exporter of a synthetic repository"""
+    dump = BytesIO()
+    synthrepo.write_dump(dump, revs)
+    dump.seek(0)
+    log = BytesIO()
+    synthrepo.write_log(log, revs)
+    svnlog = svnex.ElementTree.fromstring(log.getvalue())
+    return svnex.Exporter(dump, output, svnlog=svnlog, quiet=True, **kw)
+
+class TestStats(TempDirTest):
+    """Phase timers and counters"""
+    def setUp(self):
+        TempDirTest.setUp(self)
+        self.revs = synthrepo.generate(revisions=5, files=2)
+    
+    def test_summary(self):
+        dump = os.path.join(self.dir, "dump")
+        with open(dump, "wb") as file:
+            synthrepo.write_dump(file, self.revs)
+        log = os.path.join(self.dir, "log")
+        with open(log, "wb") as file:
+            synthrepo.write_log(file, self.revs)
+        output = os.path.join(self.dir, "output")
+        with patch("svnex.stderr", StringIO()) as stderr:
+            svnex.main(dump, "trunk@5", file=output, git_ref="refs/trunk",
+                log=log, stats=True, quiet=True)
+        lines = stderr.getvalue().splitlines()
+        self.assertRegex(lines[0], r"^[\d.]+ s elapsed, [\d.]+ revs/s, ")
+        self.assertIn("  revs: 4", lines)
+        self.assertTrue(any(line.startswith("  dump read: ")
+            for line in lines))
+    
+    def test_off(self):
+        """Only counting without the stats option"""
+        output = os.path.join(self.dir, "output")
+        with svnex.FastExportFile(output) as fex:
+            exporter = synth_exporter(self.revs, fex)
+            exporter.export("refs/trunk", "trunk", 5)
+        self.assertEqual({}, fex.stats.seconds)
+        self.assertEqual(4, fex.stats.counts["revs"])
+
+class TestMemoryBudget(TempDirTest):
+    def test_streamed(self):
+        """The same export when file texts are streamed"""
+        revs = synthrepo.generate(revisions=5, files=2)
+        actions = {node["action"] for rev in revs for node in rev["nodes"]
+            if node["kind"] == "file"}
+        self.assertEqual({"add", "change"}, actions)
+        outputs = list()
+        for budget in (None, 1):
+            output = os.path.join(self.dir, "output")
+            with svnex.FastExportFile(output) as fex:
+                exporter = synth_exporter(revs, fex, memory_budget=budget)
+                exporter.export("refs/trunk", "trunk", 5)
+            with open(output, "rb") as file:
+                outputs.append(file.read())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertGreater(fex.stats.counts["streamed bytes"], 0)
+
+class TestCheckpoint(TempDirTest):
+    """Resuming an export from the checkpoint state"""
+    def test_resume(self):
+        revs = synthrepo.generate(revisions=10, files=3, deltas=True)
+        git = os.path.join(self.dir, "git")
+        subprocess.check_call(("git", "init", "--quiet", "--", git))
+        script = 'cd "$1" && git fast-import --quiet'
+        importer = ("sh", "-c", script, "--", git)
+        state = os.path.join(self.dir, "state")
+        
+        with svnex.FastExportPipe(importer) as output, \
+                open(state, "at") as file:
+            exporter = synth_exporter(revs, output,
+                checkpoint_commits=2, state=file)
+            exporter.export("refs/heads/trunk", "trunk", 5)
+            self.assertEqual(2, output.stats.counts["checkpoints"])
+        with open(state, "rt") as file:
+            self.assertEqual(4, len(file.readlines()))
+        
+        with svnex.FastExportPipe(importer) as output, \
+                revmap.load(state) as rev_map, open(state, "at") as file:
+            exporter = synth_exporter(revs, output, rev_map=rev_map,
+                checkpoint_commits=2, state=file)
+            exporter.export("refs/heads/trunk", "trunk", 10)
+        with open(state, "rt") as file:
+            self.assertEqual(9, len(file.readlines()))
+        
+        with svnex.FastExportPipe(importer) as output:
+            exporter = synth_exporter(revs, output)
+            exporter.export("refs/heads/full", "trunk", 10)
+            self.assertEqual([], exporter.unsaved)
+        trees = list()
+        for ref in ("refs/heads/trunk", "refs/heads/full"):
+            cmd = ("git", "log", "--format=%T", ref)
+            trees.append(subprocess.check_output(cmd, cwd=git).split())
+        self.assertEqual(9, len(trees[0]))
+        self.assertEqual(trees[1], trees[0])
+    
+    def test_cli(self):
+        """The options are parsed as numbers"""
+        revs = synthrepo.generate(revisions=5, files=2)
+        dump = os.path.join(self.dir, "dump")
+        with open(dump, "wb") as file:
+            synthrepo.write_dump(file, revs)
+        log = os.path.join(self.dir, "log")
+        with open(log, "wb") as file:
+            synthrepo.write_log(file, revs)
+        git = os.path.join(self.dir, "git")
+        subprocess.check_call(("git", "init", "--quiet", "--", git))
+        state = os.path.join(self.dir, "state")
+        argv = ["svnex", "--git-ref", "refs/heads/trunk", "--log", log,
+            "--quiet", "--checkpoint-commits", "2", "--checkpoint-mb", "1",
+            "--state", state, "--memory-budget", "1000000",
+            "--", dump, "trunk@5",
+            "sh", "-c", 'cd "$0" && git fast-import --quiet', git]
+        with patch("sys.argv", argv):
+            _common.run_cli(svnex.main)
+        with open(state, "rt") as file:
+            self.assertEqual(4, len(file.readlines()))
+
+class TestSkippedBase(TestCase):
+    def runTest(self):
+        """Exporting again from a revision without a commit"""
+        revs = synthrepo.generate(revisions=5, files=2)
+        with svnex.FastExportFile(os.devnull) as fex:
+            exporter = synth_exporter(revs, fex)
+            self.assertIsNone(exporter.export("refs/t", "trunk", 1))
+            self.assertIsNotNone(exporter.export("refs/t", "trunk", 5))
+
+class TestDumpPipe(TempDirTest):
+    """Reading the dump from a pipe on stdin"""
+    def test_export(self):
+        revs = synthrepo.generate(revisions=10, files=3, branches=1,
+            copies=2)
+        dump = os.path.join(self.dir, "dump")
+        with open(dump, "wb") as file:
+            synthrepo.write_dump(file, revs)
+        log = os.path.join(self.dir, "log")
+        with open(log, "wb") as file:
+            synthrepo.write_log(file, revs)
+        expected = os.path.join(self.dir, "expected")
+        svnex.main(dump, "trunk@10", file=expected, git_ref="refs/trunk",
+            log=log, quiet=True)
+        
+        [r, w] = os.pipe()
+        with open(r, "rb") as reader:
+            def write():
+                with open(w, "wb") as writer, open(dump, "rb") as file:
+                    while True:
+                        data = file.read(1000)
+                        if not data:
+                            break
+                        writer.write(data)
+            thread = Thread(target=write)
+            thread.start()
+            self.addCleanup(thread.join)
+            self.assertFalse(reader.seekable())
+            output = os.path.join(self.dir, "output")
+            with patch("svnex.stdin", TextIOWrapper(reader)):
+                svnex.main("-", "trunk@10", file=output,
+                    git_ref="refs/trunk", log=log, quiet=True)
+        with open(expected, "rb") as expected, open(output, "rb") as output:
+            self.assertEqual(expected.read(), output.read())
+    
+    def test_no_log(self):
+        with self.assertRaises(SystemExit):
+            svnex.main("-", "trunk@10", file=os.path.join(self.dir, "out"),
+                git_ref="refs/trunk")
+
+class TestProfile(TempDirTest):
+    """The "--profile" option"""
+    def test_cli(self):
+        profile = os.path.join(self.dir, "profile")
+        def main(*, fail=False):
+            """Test entry point"""
+            if fail:
+                raise ValueError()
+        with patch("sys.argv", ["main", "--profile", profile]):
+            _common.run_cli(main)
+        self.assertIn("main", function_calls(profile))
+        self.assertIsNone(_common.profiler)
+        
+        # Statistics are written for an interrupted run
+        os.remove(profile)
+        with patch("sys.argv", ["main", "--profile", profile, "--fail"]), \
+                self.assertRaises(ValueError):
+            _common.run_cli(main)
+        self.assertIn("main", function_calls(profile))
+    
+    def test_revs(self):
+        """Only the commits in the "--profile-revs" range are profiled"""
+        revs = synthrepo.generate(revisions=5, files=2)
+        dump = os.path.join(self.dir, "dump")
+        with open(dump, "wb") as file:
+            synthrepo.write_dump(file, revs)
+        log = os.path.join(self.dir, "log")
+        with open(log, "wb") as file:
+            synthrepo.write_log(file, revs)
+        profile = os.path.join(self.dir, "profile")
+        kw = dict(file=os.path.join(self.dir, "output"),
+            git_ref="refs/trunk", log=log, quiet=True, profile_revs="3:4")
+        _common.run_profiled(svnex.main, (dump, "trunk@5"), kw, profile)
+        calls = function_calls(profile)
+        self.assertEqual(2, calls["commit"])
+        self.assertNotIn("iter_location_segments", calls)
+
+def function_calls(profile):
+    """Returns the number of calls recorded for each function name"""
+    calls = dict()
+    for [[_, _, name], [_, count, _, _, _]] in \
+            pstats.Stats(profile).stats.items():
+        calls[name] = calls.get(name, 0) + count
+    return calls
+
+class TestFilteredCopy(TempDirTest):
+    """Directory copies with an include filter"""
+    def setUp(self):
+        TempDirTest.setUp(self)
+        props = synthrepo.FILE_PROPS
+        self.revs = [
+            dict(nodes=(
+                dict(action="add", path="src", kind="dir"),
+                dict(action="add", path="src/sub", kind="dir"),
+                dict(action="add", path="src/sub/f", kind="file",
+                    props=props, content=b"f\n"),
+                dict(action="add", path="src/g", kind="file",
+                    props=props, content=b"g\n"),
+            )),
+            dict(nodes=(
+                dict(action="add", path="lib", kind="dir",
+                    copyfrom_path="src", copyfrom_rev=1),
+            )),
+        ]
+    
+    def export(self, **kw):
+        """Returns the file changes of each exported commit"""
+        output = os.path.join(self.dir, "output")
+        with svnex.FastExportFile(output) as fex:
+            exporter = synth_exporter(self.revs, fex, root="", **kw)
+            exporter.export("refs/ref", "", len(self.revs))
+        commits = list()
+        blobs = dict()
+        with open(output, "rb") as output:
+            for line in output:
+                if line == b"blob\n":
+                    [mark] = output.readline().split()[1:]
+                    [size] = output.readline().split()[1:]
+                    blobs[mark] = output.read(int(size))
+                elif line.startswith(b"commit "):
+                    commits.append(list())
+                elif line.startswith(b"M "):
+                    [_, _, mark, path] = line.split()
+                    commits[-1].append((path.decode(), blobs[mark]))
+                elif line.startswith(b"D "):
+                    [_, path] = line.split()
+                    commits[-1].append((path.decode(), None))
+        return [sorted(commit) for commit in commits]
+    
+    def test_dir_node(self):
+        """The copied directory itself is not selected"""
+        commits = self.export(include=("src", "lib/sub"))
+        self.assertEqual([
+            [("src/g", b"g\n"), ("src/sub/f", b"f\n")],
+            [("lib/sub/f", b"f\n")],
+        ], commits)
+    
+    def test_source(self):
+        """The copy source is not selected"""
+        self.assertEqual([[("lib/g", b"g\n"), ("lib/sub/f", b"f\n")]],
+            self.export(include=("lib",)))
+        self.assertEqual([[("lib/sub/f", b"f\n")]],
+            self.export(include=("lib/sub",)))
+    
+    def test_file(self):
+        """Copies of files modified and deleted outside the filter"""
+        self.revs.extend((
+            dict(nodes=(
+                dict(action="change", path="src/g", kind="file",
+                    content=b"g2\n"),
+            )),
+            dict(nodes=(
+                dict(action="add", path="h", kind="file",
+                    copyfrom_path="src/g", copyfrom_rev=3),
+                dict(action="delete", path="src"),
+            )),
+            dict(nodes=(
+                dict(action="add", path="lib2", kind="dir",
+                    copyfrom_path="src", copyfrom_rev=3),
+            )),
+        ))
+        self.assertEqual([
+            [("h", b"g2\n")],
+            [("lib2/g", b"g2\n")],
+        ], self.export(include=("h", "lib2/g")))
+    
+    def test_outside(self):
+        """Directory copy from outside the exported branch"""
+        self.revs.append(dict(nodes=(
+            dict(action="add", path="trunk", kind="dir"),
+        )))
+        self.revs.append(dict(nodes=(
+            dict(action="add", path="trunk/sub", kind="dir",
+                copyfrom_path="lib/sub", copyfrom_rev=2),
+        )))
+        with svnex.FastExportFile(os.devnull) as fex:
+            exporter = synth_exporter(self.revs, fex)
+            with self.assertRaisesRegex(LookupError, r"lib/sub@2 not exported"):
+                exporter.export("refs/ref", "trunk", 4)
+    
+    def test_text(self):
+        """Copy with its full text from outside the exported branch"""
+        self.revs.append(dict(nodes=(
+            dict(action="add", path="trunk", kind="dir"),
+            dict(action="add", path="trunk/g", kind="file",
+                copyfrom_path="src/g", copyfrom_rev=1,
+                props=synthrepo.FILE_PROPS, content=b"g\n"),
+        )))
+        output = os.path.join(self.dir, "output")
+        with svnex.FastExportFile(output) as fex:
+            exporter = synth_exporter(self.revs, fex)
+            exporter.export("refs/ref", "trunk", 3)
+        with open(output, "r", encoding="ascii") as output:
+            self.assertIn("M 644 :1 g\n", output.read())
+
 class TestAuthorsFile(TempDirTest):
     """Parsing authors file"""
     def runTest(self):
@@ -507,36 +801,334 @@ class TestAuthorsFile(TempDirTest):
         def export(self, *pos, **kw):
             pass
 
-def dump_message(file, headers, props=None, content=None):
-    msg = Message()
-    for (name, value) in headers:
-        msg[name] = value
-    payload = BytesIO()
-    
-    if props is not None:
-        start = payload.tell()
-        for (key, value) in props.items():
-            payload.write("K {}\n".format(len(key)).encode("ascii"))
-            payload.writelines((key.encode("ascii"), b"\n"))
-            payload.write("V {}\n".format(len(value)).encode("ascii"))
-            payload.writelines((value.encode("ascii"), b"\n"))
-        payload.write(b"PROPS-END\n")
+class TestFileTree(TestCase):
+    """Directory tree of exported files"""
+    def runTest(self):
+        tree = svnex.FileTree()
+        tree["file"] = (":1", "644")
+        tree["dir/sub/a"] = (":2", "644")
+        tree["dir/sub/b"] = (":3", "755")
+        tree["dir/c"] = (":4", "644")
+        self.assertEqual((":2", "644"), tree["dir/sub/a"])
+        self.assertEqual([("a", (":2", "644")), ("b", (":3", "755"))],
+            sorted(tree.walk("dir/sub")))
         
-        msg["Prop-content-length"] = format(payload.tell() - start)
+        removed = tree.delete("dir/sub")
+        self.assertEqual({"a": (":2", "644"), "b": (":3", "755")}, removed)
+        self.assertNotIn("dir/sub/a", tree)
+        self.assertEqual([("c", (":4", "644"))], list(tree.walk("dir")))
+        
+        self.assertIsNone(tree.delete("dir/missing"))
+        tree.delete("dir/c")
+        self.assertNotIn("dir", tree)
+        self.assertEqual([("file", (":1", "644"))], list(tree.walk()))
+
+class TestLocationCache(TestCase):
+    """Memoized location segments"""
+    def test_lru(self):
+        calls = list()
+        def iter_location_segments(exporter, path, rev):
+            calls.append((path, rev))
+            return ((1, rev, path),)
+        exporter = self.MockExporter()
+        cache = svnex.LocationCache(size=2)
+        with patch("svnex.iter_location_segments", iter_location_segments):
+            self.assertEqual(((1, 5, "trunk"),),
+                cache.get(exporter, "trunk", 5))
+            cache.get(exporter, "trunk", 5)
+            self.assertEqual([("trunk", 5)], calls)
+            cache.get(exporter, "branch", 5)
+            cache.get(exporter, "other", 5)
+            cache.get(exporter, "trunk", 5)
+        self.assertEqual([("trunk", 5), ("branch", 5), ("other", 5),
+            ("trunk", 5)], calls)
+    
+    class MockExporter:
+        pass
+    
+    def test_same_uuid(self):
+        """Segments are not shared between dumps of the same UUID"""
+        with TemporaryDirectory(prefix="svnex-") as dir:
+            output = os.path.join(dir, "output")
+            with svnex.FastExportFile(output) as fex:
+                revs = synthrepo.generate(revisions=6, files=2)
+                exporter = synth_exporter(revs, fex)
+                exporter.export("refs/trunk", "trunk", 6)
+                
+                revs = [dict(nodes=[dict(action="add", path="other",
+                    kind="dir")])]
+                revs.extend(dict(props={"svn:log": f"Revision {rev}"})
+                    for rev in range(2, 7))
+                exporter = synth_exporter(revs, fex)
+                with self.assertRaises(LookupError):
+                    exporter.export("refs/trunk", "trunk", 6)
+
+class TestRevisionSet(TestCase):
+    """Revision range arithmetic for merge tracking"""
+    def test_coalesce(self):
+        ranges = svnex.RangeSet(((5, 6), (1, 2), (9, 9)))
+        self.assertEqual([(1, 2), (5, 6), (9, 9)], list(ranges))
+        ranges.add(3, 4)
+        self.assertEqual([(1, 6), (9, 9)], list(ranges))
+        ranges.add(7, 20)
+        self.assertEqual([(1, 20)], list(ranges))
+        self.assertIn(20, ranges)
+        self.assertNotIn(21, ranges)
     
-    if content is not None:
-        msg["Text-content-length"] = format(len(content))
-        payload.write(content)
+    def test_subset(self):
+        small = svnex.RangeSet(((2, 3), (7, 7)))
+        self.assertTrue(small <= svnex.RangeSet(((1, 10),)))
+        self.assertFalse(small <= svnex.RangeSet(((1, 5), (8, 10))))
+        self.assertTrue(svnex.RangeSet() <= small)
+    
+    def test_mergeinfo(self):
+        mergeinfo = svnex.parse_mergeinfo_property(
+            "/branch:2-4,6,8*\n/other:10\n")
+        self.assertEqual("/branch:2-4,6\n/other:10", repr(mergeinfo))
+        same = svnex.RevisionSet()
+        same.add_segment("/other", 10, 10)
+        same.add_segment("/branch", 2, 4)
+        same.add_segment("/branch", 6, 6)
+        same.branches["/empty"]
+        self.assertEqual(mergeinfo, same)
+        self.assertTrue(mergeinfo <= same)
+        same.add_segment("/branch", 5, 5)
+        self.assertNotEqual(mergeinfo, same)
+        self.assertTrue(mergeinfo <= same)
+        self.assertFalse(same <= mergeinfo)
+
+class TestReachability(TestCase):
+    """Independent merge heads"""
+    def runTest(self):
+        index = svnex.Reachability()
+        index.add(":1", ("base",))
+        index.add(":2", (":1",))
+        index.add(":3", (":1",))
+        index.add(":4", (":2", ":3"))
+        self.assertTrue(index.is_ancestor("base", ":4"))
+        self.assertTrue(index.is_ancestor(":3", ":4"))
+        self.assertFalse(index.is_ancestor(":3", ":2"))
+        self.assertFalse(index.is_ancestor(":4", ":1"))
+        self.assertEqual([":4"], index.independent([":2", ":4", ":1"]))
+        self.assertEqual([":3"], index.independent([":2", ":3"], base=":2"))
+        self.assertEqual([":2", ":3"], index.independent([":2", ":3", ":2"]))
+
+class TestLinearReachability(TestCase):
+    """Reachability along a long linear history"""
+    def runTest(self):
+        index = svnex.Reachability()
+        parent = "base"
+        for i in range(1, 50001):
+            index.add(f":{i}", (parent,))
+            parent = f":{i}"
+        self.assertTrue(index.is_ancestor("base", ":50000"))
+        self.assertTrue(index.is_ancestor(":1", ":50000"))
+        self.assertFalse(index.is_ancestor(":50000", ":1"))
+        self.assertEqual([":49999"],
+            index.independent([":2", ":49999", ":25000"], base=":1"))
+
+class TestBinaryRevMap(TempDirTest):
+    """Binary revision map format"""
+    def runTest(self):
+        filename = os.path.join(self.dir, "rev-map")
+        with open(filename, "wb") as file:
+            revmap.write_binary(file, (
+                ("/trunk", 1, "01" * 20),
+                ("/trunk", 5, "05" * 20),
+                ("/branch", 3, "03" * 20),
+            ))
+        rev_map = revmap.load(filename)
+        self.addCleanup(rev_map.close)
+        self.assertIsNone(rev_map.floor("trunk", 0))
+        self.assertEqual((1, "01" * 20), rev_map.floor("trunk", 4))
+        self.assertEqual((5, "05" * 20), rev_map.floor("trunk", 100))
+        self.assertEqual((3, "03" * 20), rev_map.floor("branch", 3))
+        self.assertIsNone(rev_map.floor("missing", 3))
+        
+        rev_map.add("trunk", 7, ":1")
+        self.assertEqual((5, "05" * 20), rev_map.floor("trunk", 6))
+        self.assertEqual((7, ":1"), rev_map.floor("trunk", 7))
+        
+        with revmap.load(filename) as rev_map:
+            self.assertEqual((1, "01" * 20), rev_map.floor("trunk", 1))
+        self.assertTrue(rev_map.map.closed)
+        
+        # Text format fallback
+        with open(filename, "wt") as file:
+            file.write("/trunk@1 {}\n/trunk@5 {}\n".format("01" * 20,
+                "05" * 20))
+        with revmap.load(filename) as rev_map:
+            self.assertNotIsInstance(rev_map, revmap.BinaryRevMap)
+            self.assertEqual((1, "01" * 20), rev_map.floor("trunk", 4))
+            self.assertEqual((5, "05" * 20), rev_map.floor("trunk", 5))
+            self.assertIsNone(rev_map.floor("branch", 5))
+
+class TestNodeProgress(TestCase):
+    """Aggregated node progress"""
+    def runTest(self):
+        terminal = StringIO()
+        verbose = StringIO()
+        progress = svnex.NodeProgress(terminal, verbose, period=1e9)
+        progress.revision(5)
+        for i in range(100):
+            progress.node("M", f"file{i}")
+        progress.node("A", "dir/")
+        progress.finish()
+        self.assertEqual(" 1 A, 100 M", terminal.getvalue().split("\b")[-1])
+        lines = verbose.getvalue().splitlines()
+        self.assertEqual(101, len(lines))
+        self.assertEqual("r5 M file0", lines[0])
+
+class TestPathFilter(TestCase):
+    def runTest(self):
+        filter = svnex.PathFilter(include=("src", "doc/*.txt"),
+            exclude=("src/gen", "*.o"))
+        self.assertTrue(filter.selected("src/main.c"))
+        self.assertTrue(filter.selected("src"))
+        self.assertFalse(filter.selected("src/gen/table.c"))
+        self.assertFalse(filter.selected("src/main.o"))
+        self.assertFalse(filter.selected("srcfile"))
+        self.assertTrue(filter.selected("doc/a.txt"))
+        self.assertFalse(filter.selected("doc/a.html"))
+        self.assertTrue(filter.touches("doc"))
+        
+        filter = svnex.PathFilter(include=("a/b",))
+        self.assertTrue(filter.touches("a"))
+        self.assertFalse(filter.selected("a"))
+        self.assertFalse(filter.touches("c"))
+        
+        filter = svnex.PathFilter(include=("v1.[!0]*", "a+b?"))
+        self.assertTrue(filter.selected("v1.2/file"))
+        self.assertFalse(filter.selected("v1.0"))
+        self.assertFalse(filter.selected("v1x2"))
+        self.assertTrue(filter.selected("a+bc"))
+        self.assertFalse(filter.selected("aabc"))
+
+class TestDumpLog(TestCase):
+    """Log derived from the dump matches the "svn log" output"""
+    def runTest(self):
+        revs = synthrepo.generate(revisions=10, files=3, branches=1,
+            copies=2)
+        revs.append(dict(props={"svn:author": "user"}, nodes=[
+            dict(action="delete", path="trunk/file0"),
+        ]))
+        dump = BytesIO()
+        synthrepo.write_dump(dump, revs)
+        dump.seek(0)
+        log = BytesIO()
+        synthrepo.write_log(log, revs)
+        expected = svnex.ElementTree.fromstring(log.getvalue())
+        self.assertEqual(summarize_log(expected),
+            summarize_log(svnex.dump_log(dump)))
+
+def summarize_log(log):
+    entries = list()
+    for entry in log:
+        author = entry.find("author")
+        if author is not None:
+            author = author.text
+        paths = list()
+        for path in entry.find("paths"):
+            paths.append((path.text, path.get("action"),
+                path.get("copyfrom-path"), path.get("copyfrom-rev")))
+        entries.append((entry.get("revision"), author, sorted(paths)))
+    return entries
+
+class TestFileHistory(TestCase):
+    def runTest(self):
+        history = svnex.FileHistory()
+        history.set("trunk/a", 2, (":1", "644"))
+        history.set("trunk/dir/b", 3, (":2", "755"))
+        history.set("trunk/a", 5, (":3", "644"))
+        history.set("trunk/dir/b", 6, None)
+        self.assertIsNone(history.get("trunk/a", 1))
+        self.assertEqual((":1", "644"), history.get("trunk/a", 4))
+        self.assertEqual((":3", "644"), history.get("trunk/a", 5))
+        self.assertEqual([("a", (":1", "644")), ("dir/b", (":2", "755"))],
+            sorted(history.walk("trunk", 4)))
+        self.assertEqual([("a", (":3", "644"))],
+            list(history.walk("trunk", 6)))
+
+class TestCopyStream(TempDirTest):
+    def runTest(self):
+        data = bytes(range(256)) * 100
+        source = os.path.join(self.dir, "source")
+        with open(source, "wb") as file:
+            file.write(data)
+        
+        # Kernel copy between files, with buffered data around it
+        with open(source, "rb") as file, \
+                open(os.path.join(self.dir, "dest"), "w+b") as dest:
+            file.read(10)
+            dest.write(b"head")
+            _common.copy_stream(file, dest, 20000)
+            dest.write(b"tail")
+            self.assertEqual(data[20010:20020], file.read(10))
+            dest.seek(0)
+            self.assertEqual(b"head" + data[10:20010] + b"tail", dest.read())
+        
+        # Chunks between in-memory files
+        file = BytesIO(data)
+        dest = BytesIO()
+        _common.copy_stream(file, dest, 1000, bufsize=300)
+        self.assertEqual(data[:1000], dest.getvalue())
+        self.assertEqual(1000, file.tell())
+
+class TestSvndiff(TestCase):
+    def test_windows(self):
+        source = bytes(range(256)) * 1000
+        target = source[:150000] + b"inserted" + source[150000:]
+        delta = _common.encode_svndiff(source, target)
+        self.assertEqual(target, _common.apply_svndiff(source, delta))
+        self.assertEqual(b"", _common.apply_svndiff(None, b"SVN\x00"))
     
-    if props is not None or content is not None:
-        payload = payload.getvalue()
-        msg["Content-length"] = format(len(payload))
+    def test_insertion(self):
+        """Data after an insertion is still copied from the source"""
+        rng = Random(0)
+        source = bytes(rng.randrange(256) for _ in range(300000))
+        target = source[:1000] + b"inserted" + source[1000:200000] \
+            + source[250000:]
+        delta = _common.encode_svndiff(source, target)
+        self.assertEqual(target, _common.apply_svndiff(source, delta))
+        self.assertLess(len(delta), 100)
         
-        # Workaround for Python issue 18324, "set_payload does not handle
-        # binary payloads correctly", http://bugs.python.org/issue18324
-        msg.set_payload(payload.decode("ascii", "surrogateescape"))
+        # Source views must not slide backwards
+        delta = BytesIO(delta[4:])
+        views = list()
+        while delta.read(1):
+            delta.seek(-1, SEEK_CUR)
+            [offset, length, _, instructions, new] = \
+                (_common.read_int(delta) for _ in range(5))
+            delta.seek(instructions + new, SEEK_CUR)
+            views.append((offset, offset + length))
+        self.assertEqual(3, len(views))
+        self.assertEqual(sorted(views), views)
+        self.assertEqual(sorted(end for [_, end] in views),
+            [end for [_, end] in views])
     
-    BytesGenerator(file, mangle_from_=False).flatten(msg)
+    def test_compressed(self):
+        """Version 1 with compressed new data"""
+        text = b"compressible " * 100
+        instructions = BytesIO()
+        _common._write_instruction(instructions, _common.SVNDIFF_NEW,
+            len(text))
+        instructions = instructions.getvalue()
+        sections = list()
+        for [data, compressed] in (
+            (instructions, instructions),
+            (text, zlib.compress(text)),
+        ):
+            section = BytesIO()
+            _common.write_int(section, len(data))
+            section.write(compressed)
+            sections.append(section.getvalue())
+        delta = BytesIO()
+        delta.write(b"SVN\x01")
+        for n in (0, 0, len(text), len(sections[0]), len(sections[1])):
+            _common.write_int(delta, n)
+        delta.writelines(sections)
+        self.assertEqual(text, _common.apply_svndiff(None, delta.getvalue()))
+
 
 if __name__ == "__main__":
     import unittest